@@ -235,7 +235,8 @@ def main():
     
     # Calculate stats
     total_answers = len(answers_df)
-    correct_answers = len(answers_df.filter(pl.col("is_correct") == True))
+    # Counted in one expression, without materializing the filtered frame
+    correct_answers = answers_df.select((pl.col("is_correct") == True).sum()).item()
     incorrect_answers = total_answers - correct_answers
     accuracy = (correct_answers / total_answers * 100) if total_answers > 0 else 0
     
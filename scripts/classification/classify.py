@@ -10,6 +10,11 @@ from datetime import datetime
 import polars as pl
 from google import genai
 
+try:
+    import ijson  # Picks its fastest backend (yajl2_c) automatically
+except ImportError:
+    ijson = None  # Fall back to loading the whole file
+
 # ============================================================================
 # Configuration
 # ============================================================================
@@ -47,6 +52,9 @@ CATEGORIES = [
     "Medicina Legal",
 ]
 
+# (lowercased, original) pairs for the substring fallbacks in categorize_question
+CATEGORIES_LOWER = tuple((cat.lower(), cat) for cat in CATEGORIES)
+
 API_KEY = os.getenv("GEMINI_API_KEY")
 assert API_KEY, "Set GEMINI_API_KEY environment variable"
 
@@ -154,13 +162,15 @@ def categorize_question(question_text: str, correct_answer: str, explanation: st
                     return category, confidence
 
                 # Try fuzzy matching
-                for valid_cat in CATEGORIES:
-                    if valid_cat.lower() in category.lower():
+                category_lower = category.lower()
+                for valid_lower, valid_cat in CATEGORIES_LOWER:
+                    if valid_lower in category_lower:
                         return valid_cat, confidence * 0.9  # Slightly reduce confidence
 
                 # If we got here, try to extract category from text
-                for valid_cat in CATEGORIES:
-                    if valid_cat.lower() in response_text.lower():
+                response_lower = response_text.lower()
+                for valid_lower, valid_cat in CATEGORIES_LOWER:
+                    if valid_lower in response_lower:
                         return valid_cat, 0.5
 
                 # Last resort: return most general category with low confidence
@@ -170,8 +180,8 @@ def categorize_question(question_text: str, correct_answer: str, explanation: st
             except json.JSONDecodeError:
                 # Fallback: try to find category name in plain text
                 response_lower = response_text.lower()
-                for valid_cat in CATEGORIES:
-                    if valid_cat.lower() in response_lower:
+                for valid_lower, valid_cat in CATEGORIES_LOWER:
+                    if valid_lower in response_lower:
                         return valid_cat, 0.5
 
                 print(f"    ⚠️ Could not parse JSON, defaulting to Medicina Legal")
@@ -474,9 +484,13 @@ def main():
     # Verify file was written
     assert output_file.exists(), "Output file does not exist!"
 
-    with open(output_file, "r") as f:
-        verify_data = json.load(f)
-        assert len(verify_data) == len(questions_list), "File verification failed!"
+    # Count the saved records without building them all again
+    with open(output_file, "rb") as f:
+        if ijson is not None:
+            saved_count = sum(1 for _ in ijson.items(f, "item"))
+        else:
+            saved_count = len(json.load(f))
+    assert saved_count == len(questions_list), "File verification failed!"
 
     print(f"✅ File verification passed")
 
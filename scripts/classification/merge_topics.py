@@ -40,11 +40,9 @@ Environment variables required for image migration:
 
 import sys
 import io
-import json
 import csv
 import os
 import re
-import time
 from pathlib import Path
 from collections import Counter
 from urllib.parse import urlparse
@@ -54,6 +52,11 @@ import requests
 from dotenv import load_dotenv
 from sys import path as sys_path
 
+try:
+    import ijson  # Picks its fastest backend (yajl2_c) automatically
+except ImportError:
+    ijson = None  # Fall back to loading the whole file
+
 load_dotenv()
 
 # Fix encoding on Windows
@@ -67,10 +70,13 @@ if sys.platform == "win32":
 # Add parent directory to path to import from extraction
 SCRIPT_DIR = Path(__file__).parent
 EXTRACTION_DIR = SCRIPT_DIR.parent / "extraction"
+DATABASE_DIR = SCRIPT_DIR.parent / "database"
 sys_path.insert(0, str(EXTRACTION_DIR))
+sys_path.insert(0, str(DATABASE_DIR))
 
 from config import get_processed_data_root
-from utils import save_questions, print_extraction_summary, validate_question_strict
+from utils import save_questions, print_extraction_summary, validate_question_strict, read_json, write_json
+from rate_limit import TokenBucket, get_retry_delay
 
 PROCESSED_DIR = get_processed_data_root()
 
@@ -123,6 +129,11 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 MOODLE_SESSION = os.getenv("MOODLE_SESSION", "")
 BUCKET_NAME = "question-images"
+MAX_DOWNLOAD_ATTEMPTS = 4
+# At most one Moodle request every 0.1s (no burst); 429/503 pauses the bucket
+DOWNLOAD_RATE = 10.0
+DOWNLOAD_BURST = 1
+UNSAFE_PATH_CHARS_RE = re.compile(r"[^a-zA-Z0-9_-]")
 
 
 # ============================================================================
@@ -145,21 +156,34 @@ def get_supabase_client():
     return create_client(SUPABASE_URL, SUPABASE_KEY)
 
 
-def download_image(url: str, session: requests.Session) -> bytes | None:
-    """Download image from Moodle URL"""
-    try:
-        response = session.get(url, timeout=30)
-        response.raise_for_status()
+def download_image(url: str, session: requests.Session, bucket: TokenBucket) -> bytes | None:
+    """Download image from Moodle URL (rate limited; backs off and retries on 429/503)"""
+    for attempt in range(MAX_DOWNLOAD_ATTEMPTS):
+        bucket.acquire()
+
+        try:
+            response = session.get(url, timeout=30)
+
+            if response.status_code in (429, 503):
+                delay = get_retry_delay(response, attempt)
+                print(f"  ⏳ HTTP {response.status_code}, waiting {delay:.1f}s...")
+                bucket.throttle(delay)
+                continue
+
+            response.raise_for_status()
 
-        content_type = response.headers.get("content-type", "")
-        if "image" not in content_type and "octet-stream" not in content_type:
-            print(f"  ⚠️  Not an image: {content_type}")
+            content_type = response.headers.get("content-type", "")
+            if "image" not in content_type and "octet-stream" not in content_type:
+                print(f"  ⚠️  Not an image: {content_type}")
+                return None
+
+            return response.content
+        except requests.RequestException as e:
+            print(f"  ❌ Download failed: {e}")
             return None
 
-        return response.content
-    except requests.RequestException as e:
-        print(f"  ❌ Download failed: {e}")
-        return None
+    print(f"  ❌ Download failed: gave up after {MAX_DOWNLOAD_ATTEMPTS} attempts")
+    return None
 
 
 def generate_storage_path(question_id: str, image_index: int, original_url: str) -> str:
@@ -167,7 +191,7 @@ def generate_storage_path(question_id: str, image_index: int, original_url: str)
     parsed = urlparse(original_url)
     filename = parsed.path.split("/")[-1]
     ext = Path(filename).suffix or ".jpg"
-    safe_id = re.sub(r'[^a-zA-Z0-9_-]', '_', question_id)
+    safe_id = UNSAFE_PATH_CHARS_RE.sub('_', question_id)
     return f"{safe_id}_{image_index}{ext}"
 
 
@@ -210,47 +234,54 @@ def migrate_images(questions: list[dict]) -> list[dict]:
     # Setup Supabase client
     supabase = get_supabase_client()
 
-    stats = {"total": 0, "migrated": 0, "skipped": 0, "failed": 0}
-
-    questions_with_images = [q for q in questions if q.get("images")]
-    print(f"📸 Found {len(questions_with_images)} questions with images")
-
-    for question in questions_with_images:
-        question_id = question["question_id"]
-        new_images = []
+    # Minimum interval between Moodle requests
+    bucket = TokenBucket(DOWNLOAD_RATE, DOWNLOAD_BURST)
 
-        for idx, image_url in enumerate(question.get("images", []), 1):
-            stats["total"] += 1
-
-            if not image_url or is_already_migrated(image_url):
-                new_images.append(image_url)
-                stats["skipped"] += 1
-                continue
-
-            print(f"  📥 {question_id} img {idx}...", end=" ")
-
-            # Download
-            image_data = download_image(image_url, session)
-            if not image_data:
-                stats["failed"] += 1
-                new_images.append(image_url)
-                continue
-
-            # Upload
-            storage_path = generate_storage_path(question_id, idx, image_url)
-            public_url = upload_to_supabase(supabase, storage_path, image_data)
-
-            if public_url:
-                stats["migrated"] += 1
-                new_images.append(public_url)
-                print("✅")
-            else:
-                stats["failed"] += 1
-                new_images.append(image_url)
+    stats = {"total": 0, "migrated": 0, "skipped": 0, "failed": 0}
 
-            time.sleep(0.1)  # Rate limiting
+    # Flat work list of images still on Moodle: (question_id, 1-based index, url)
+    stats["total"] = sum(len(q.get("images") or ()) for q in questions)
+    work = [
+        (q["question_id"], idx, url)
+        for q in questions
+        for idx, url in enumerate(q.get("images") or (), 1)
+        if not is_already_migrated(url)
+    ]
+    stats["skipped"] = stats["total"] - len(work)
+    print(f"📸 Found {len(work)} images to migrate ({stats['skipped']} already migrated)")
+
+    # (question_id, index) -> Supabase URL, for successful uploads only
+    results: dict[tuple[str, int], str] = {}
+
+    for question_id, idx, image_url in work:
+        print(f"  📥 {question_id} img {idx}...", end=" ")
+
+        # Download
+        image_data = download_image(image_url, session, bucket)
+        if not image_data:
+            stats["failed"] += 1
+            continue
 
-        question["images"] = new_images
+        # Upload
+        storage_path = generate_storage_path(question_id, idx, image_url)
+        public_url = upload_to_supabase(supabase, storage_path, image_data)
+
+        if public_url:
+            stats["migrated"] += 1
+            results[(question_id, idx)] = public_url
+            print("✅")
+        else:
+            stats["failed"] += 1
+
+    # Rebuild image lists in one pass (failed images keep their original URL)
+    if results:
+        for q in questions:
+            if q.get("images"):
+                question_id = q["question_id"]
+                q["images"] = [
+                    results.get((question_id, idx), url)
+                    for idx, url in enumerate(q["images"], 1)
+                ]
 
     print(f"\n{'='*60}")
     print("📊 IMAGE MIGRATION SUMMARY")
@@ -272,8 +303,7 @@ def load_fresh_extraction() -> list[dict]:
     """Load fresh extraction JSON file"""
     assert FRESH_FILE.exists(), f"Fresh extraction file not found: {FRESH_FILE}"
 
-    with open(FRESH_FILE, "r", encoding="utf-8") as f:
-        questions = json.load(f)
+    questions = read_json(FRESH_FILE)
 
     assert isinstance(questions, list), "Fresh extraction must be a list"
     assert len(questions) > 0, "Fresh extraction is empty"
@@ -289,13 +319,26 @@ def load_historical_topics() -> pl.DataFrame:
         print(f"ℹ️  Historical file not found: {HISTORICAL_FILE.name} (optional)")
         return pl.DataFrame({"question_id": [], "topic": []})
 
-    with open(HISTORICAL_FILE, "r", encoding="utf-8") as f:
-        historical = json.load(f)
-
-    assert isinstance(historical, list), "Historical file must be a list"
-
-    # Create DataFrame with only question_id and topic columns
-    df = pl.DataFrame(historical).select(["question_id", "topic"])
+    if ijson is not None:
+        # Stream records and keep only the two columns, never the full list of dicts
+        question_ids = []
+        topics = []
+        with open(HISTORICAL_FILE, "rb") as f:
+            # "item" matches nothing under a top-level object, so check the shape first
+            _, first_event, _ = next(ijson.parse(f))
+            assert first_event == "start_array", "Historical file must be a list"
+            f.seek(0)
+            for q in ijson.items(f, "item"):
+                question_ids.append(q.get("question_id"))
+                topics.append(q.get("topic"))
+        df = pl.DataFrame({"question_id": question_ids, "topic": topics})
+    else:
+        historical = read_json(HISTORICAL_FILE)
+
+        assert isinstance(historical, list), "Historical file must be a list"
+
+        # Create DataFrame with only question_id and topic columns
+        df = pl.DataFrame(historical).select(["question_id", "topic"])
 
     print(f"✅ Loaded {len(df)} historical topics from {HISTORICAL_FILE.name}")
 
@@ -501,8 +544,11 @@ def main():
     # Save outputs
     print(f"\n💾 Saving outputs...")
     OUTPUT_FINAL.parent.mkdir(parents=True, exist_ok=True)
-    with open(OUTPUT_FINAL, "w", encoding="utf-8") as f:
-        json.dump(merged_questions, f, ensure_ascii=False, indent=2)
+    # Write to a temp file and swap it in: the previous questions_ready.json
+    # inode is never truncated, so hard links/snapshots of it stay intact
+    temp_file = OUTPUT_FINAL.with_suffix(".json.tmp")
+    write_json(temp_file, merged_questions)
+    os.replace(temp_file, OUTPUT_FINAL)
 
     assert OUTPUT_FINAL.exists(), f"Failed to create output file: {OUTPUT_FINAL}"
     print(f"✅ Saved: {OUTPUT_FINAL.name}")
@@ -28,6 +28,9 @@ load_dotenv()
 PROCESSED_DIR = Path(os.getenv("EUNACOM_PROCESSED_DATA", ""))
 MAPPINGS_FILE = PROCESSED_DIR / "image_mappings.json" if PROCESSED_DIR else None
 
+# Questions per multi-row INSERT / commit (PostgreSQL gains little past ~1000 rows per statement)
+INSERT_BATCH_SIZE = 500
+
 # ============================================================================
 # TEST MODE - Set to True to import only questions with images
 # ============================================================================
@@ -35,10 +38,13 @@ TEST_MODE = False
 TEST_LIMIT = 200
 TEST_IMAGES_ONLY = False  # When TEST_MODE=True, only import questions with images
 
-# Add parent directory to path
+# Add parent directory to path (and extraction/, for config and the shared JSON I/O)
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "extraction")))
 
 from src.database import insert_questions_from_json, get_question_count, get_existing_question_ids
+from config import get_processed_data_root
+from utils import load_mappings_with_log, read_json
 
 
 # ============================================================================
@@ -65,6 +71,11 @@ OPTIONAL_FIELDS = [
 
 ANSWER_OPTION_REQUIRED = ["letter", "text", "is_correct"]
 
+# Set forms for the fast path: one subset test per question/option, fields are only
+# walked in order (for the issue messages) when something is missing
+REQUIRED_FIELDS_SET = frozenset(REQUIRED_FIELDS)
+ANSWER_OPTION_REQUIRED_SET = frozenset(ANSWER_OPTION_REQUIRED)
+
 
 # ============================================================================
 # Validation with Assertions
@@ -79,9 +90,10 @@ def validate_question_structure(question: dict) -> tuple[bool, list[str]]:
     q_id = question.get("question_id", "UNKNOWN")
 
     # Check required fields
-    for field in REQUIRED_FIELDS:
-        if field not in question:
-            issues.append(f"[{q_id}] Missing field: {field}")
+    if not REQUIRED_FIELDS_SET <= question.keys():
+        for field in REQUIRED_FIELDS:
+            if field not in question:
+                issues.append(f"[{q_id}] Missing field: {field}")
 
     # question_id validation
     q_id_value = question.get("question_id", "")
@@ -105,18 +117,22 @@ def validate_question_structure(question: dict) -> tuple[bool, list[str]]:
     elif len(opts) == 0:
         issues.append(f"[{q_id}] No answer options")
     else:
-        # Validate each option structure
+        # Validate each option structure, counting correct options in the same pass
+        correct_count = 0
         for i, opt in enumerate(opts):
             if not isinstance(opt, dict):
                 issues.append(f"[{q_id}] answer_options[{i}] must be a dict")
                 continue
             
-            for field in ANSWER_OPTION_REQUIRED:
-                if field not in opt:
-                    issues.append(f"[{q_id}] answer_options[{i}] missing '{field}'")
+            if not ANSWER_OPTION_REQUIRED_SET <= opt.keys():
+                for field in ANSWER_OPTION_REQUIRED:
+                    if field not in opt:
+                        issues.append(f"[{q_id}] answer_options[{i}] missing '{field}'")
+
+            if opt.get("is_correct", False):
+                correct_count += 1
         
         # Must have exactly one correct answer
-        correct_count = sum(1 for opt in opts if opt.get("is_correct", False))
         if correct_count == 0:
             issues.append(f"[{q_id}] No correct answer marked")
         elif correct_count > 1:
@@ -178,12 +194,15 @@ def assert_no_duplicate_ids(questions: list[dict]):
 # ============================================================================
 
 def load_image_mappings() -> dict[str, str]:
-    """Load image mappings from file (original_url -> supabase_url)"""
-    if not MAPPINGS_FILE or not MAPPINGS_FILE.exists():
+    """
+    Load image mappings from file (original_url -> supabase_url).
+    Also overlays image_mappings.jsonl, the append log left behind if a
+    migration run was interrupted before compacting.
+    """
+    if not MAPPINGS_FILE:
         return {}
 
-    with open(MAPPINGS_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return load_mappings_with_log(MAPPINGS_FILE)
 
 
 def apply_image_mappings(questions: list[dict], mappings: dict[str, str]) -> tuple[list[dict], dict]:
@@ -245,8 +264,7 @@ def import_questions_from_file(filepath: str, mode: str = "insert-only"):
     assert os.path.exists(filepath), f"File not found: {filepath}"
 
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            questions = json.load(f)
+        questions = read_json(filepath)
     except json.JSONDecodeError as e:
         raise AssertionError(f"Invalid JSON in {filepath}: {e}")
 
@@ -304,15 +322,12 @@ def import_questions_from_file(filepath: str, mode: str = "insert-only"):
     with_images_count = 0
     recon_count = 0
 
-    for i, q in enumerate(questions, 1):
+    for q in questions:
         is_valid, issues = validate_question_structure(q)
 
         if not is_valid:
+            # Reported after the loop, not per question
             all_issues.extend(issues)
-            # Print first 10 issues inline
-            if len([iss for iss in all_issues if iss.startswith(f"[{q.get('question_id', 'UNKNOWN')}]")]) <= 1:
-                for iss in issues[:3]:
-                    print(f"  ⚠️  {iss}")
             continue
 
         # Ensure optional fields exist
@@ -331,6 +346,13 @@ def import_questions_from_file(filepath: str, mode: str = "insert-only"):
 
         valid_questions.append(q)
 
+    # First 10 issues in a single write
+    if all_issues:
+        lines = [f"  ⚠️  {iss}" for iss in all_issues[:10]]
+        if len(all_issues) > 10:
+            lines.append(f"  ... and {len(all_issues) - 10} more issues")
+        print("\n".join(lines))
+
     print(f"\n{'='*60}")
     print(f"📊 VALIDATION RESULTS")
     print(f"{'='*60}")
@@ -394,7 +416,9 @@ def import_questions_from_file(filepath: str, mode: str = "insert-only"):
     
     # Use upsert=False for insert-only mode
     use_upsert = (mode == "upsert")
-    success_count, error_count = insert_questions_from_json(valid_questions, upsert=use_upsert)
+    success_count, error_count = insert_questions_from_json(
+        valid_questions, batch_size=INSERT_BATCH_SIZE, upsert=use_upsert
+    )
 
     print(f"\n✅ Successfully inserted: {success_count}")
     print(f"❌ Database errors: {error_count}")
@@ -436,12 +460,6 @@ def import_questions_from_file(filepath: str, mode: str = "insert-only"):
 
 def get_default_input_path() -> str:
     """Get default input path from config (respects EUNACOM_PROCESSED_DATA env var)"""
-    # Add extraction dir to path to import config
-    script_dir = os.path.dirname(__file__)
-    extraction_dir = os.path.join(script_dir, "..", "extraction")
-    sys.path.insert(0, extraction_dir)
-
-    from config import get_processed_data_root
     return str(get_processed_data_root() / "questions_ready.json")
 
 
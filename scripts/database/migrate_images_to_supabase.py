@@ -5,26 +5,46 @@ INCREMENTAL MIGRATION:
 - Maintains image_mappings.json: {original_url -> supabase_url}
 - Only downloads/uploads images NOT already in mappings
 - Never modifies questions_ready.json (import_questions.py handles merging)
-- Saves progress after each successful upload (resume-safe)
+- Appends successful uploads to image_mappings.jsonl in fsynced batches (resume-safe)
+- Compacts the .jsonl log into image_mappings.json periodically and at the end
 
 Usage:
     python migrate_images_to_supabase.py --test       # Test with 5 questions
     python migrate_images_to_supabase.py --full       # Process all pending images
+    python migrate_images_to_supabase.py --full --async  # Concurrent downloads (needs aiohttp)
     python migrate_images_to_supabase.py --status     # Show migration status
 """
 
+import asyncio
+import hashlib
 import json
 import logging
 import os
 import re
+import sys
+import threading
 import time
+from collections import Counter, namedtuple
 from pathlib import Path
-from urllib.parse import urlparse
+from urllib.parse import quote, urlparse
 
 import requests
 from dotenv import load_dotenv
 from supabase import create_client
 
+from rate_limit import TokenBucket, get_retry_delay
+
+# Shared JSON I/O (orjson when available) lives in extraction/utils.py
+sys.path.insert(0, str(Path(__file__).parent.parent / "extraction"))
+
+from utils import load_mappings_with_log, read_json, write_json
+
+try:
+    import aiohttp
+    from yarl import URL
+except ImportError:
+    aiohttp = None  # Only needed for --async
+
 load_dotenv()
 
 
@@ -42,11 +62,51 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 BUCKET_NAME = "question-images"
 
+# Host that marks a URL as already living in Supabase Storage
+SUPABASE_HOST = urlparse(SUPABASE_URL).netloc if SUPABASE_URL else "supabase"
+
+# Public object URLs are deterministic, so they are built locally
+PUBLIC_URL_PREFIX = f"{SUPABASE_URL.rstrip('/')}/storage/v1/object/public/{BUCKET_NAME}/" if SUPABASE_URL else ""
+
 MOODLE_SESSION_COOKIE = os.getenv("MOODLE_SESSION", "")
+MOODLE_HOST = "cursosonline.doctorguevara.cl"
 
 PROCESSED_DIR = Path(os.getenv("EUNACOM_PROCESSED_DATA"))
 QUESTIONS_FILE = PROCESSED_DIR / "questions_ready.json"
 MAPPINGS_FILE = PROCESSED_DIR / "image_mappings.json"
+MAPPINGS_LOG_FILE = MAPPINGS_FILE.with_suffix(".jsonl")
+
+FLUSH_EVERY = 50     # Write + fsync the append log every N uploads
+COMPACT_EVERY = 500  # Fold the append log into the snapshot every N uploads
+
+# Download rate limiting (backs off only when Moodle pushes back)
+DOWNLOAD_RATE = 10.0    # Requests per second
+DOWNLOAD_BURST = 20
+MAX_DOWNLOAD_ATTEMPTS = 4
+RETRY_STATUS_CODES = {429, 503}
+
+# Async download path: max in-flight requests (each is a coroutine, not a thread)
+DOWNLOAD_CONCURRENCY = 64
+DOWNLOAD_CONCURRENCY_PER_HOST = 32
+
+# Magic-byte prefixes for image types Moodle serves (WebP is checked separately)
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG", "image/png"),
+    (b"GIF8", "image/gif"),
+)
+MIME_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+}
+
+# Content-addressed object names: "<sha256[:2]>/<sha256><ext>"
+CONTENT_PATH_RE = re.compile(r"/([0-9a-f]{2})/(\1[0-9a-f]{62})\.\w+$")
+
+# One image still to migrate (index is 1-based within the question's images)
+PendingImage = namedtuple("PendingImage", "question_id index url")
 
 
 # ============================================================================
@@ -54,27 +114,82 @@ MAPPINGS_FILE = PROCESSED_DIR / "image_mappings.json"
 # ============================================================================
 
 def load_mappings() -> dict[str, str]:
-    """Load existing image mappings from file"""
-    if not MAPPINGS_FILE.exists():
-        return {}
-
-    with open(MAPPINGS_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+    """Load image mappings: JSON snapshot overlaid with the JSONL append log"""
+    return load_mappings_with_log(MAPPINGS_FILE)
 
 
 def save_mappings(mappings: dict[str, str]):
     """Save mappings to file (atomic write)"""
     temp_file = MAPPINGS_FILE.with_suffix(".tmp")
-    with open(temp_file, "w", encoding="utf-8") as f:
-        json.dump(mappings, f, ensure_ascii=False, indent=2)
+    write_json(temp_file, mappings)
     temp_file.replace(MAPPINGS_FILE)
 
 
+def ends_with_newline(path: Path) -> bool:
+    """True if the (non-empty) file's last byte is a newline"""
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+class MappingLog:
+    """
+    Append-only JSONL log of {original_url: supabase_url} entries.
+    Buffers entries and writes + fsyncs them in batches, so a crash loses
+    at most the last `flush_every` uploads (they are simply re-migrated).
+    Thread-safe.
+    """
+
+    def __init__(self, path: Path = MAPPINGS_LOG_FILE, flush_every: int = FLUSH_EVERY):
+        self.path = path
+        self.flush_every = flush_every
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+        # A crash can leave a torn last line: end it here, or the next record would be
+        # glued onto it and dropped together with it by load_mappings
+        if self._file.tell() and not ends_with_newline(path):
+            self._file.write("\n")
+            self._file.flush()
+
+    def add(self, url: str, public_url: str):
+        """Record one mapping; flushes when the batch is full"""
+        with self._lock:
+            self._buffer.append((url, public_url))
+            if len(self._buffer) >= self.flush_every:
+                self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        self._file.write("".join(
+            json.dumps({url: public_url}, ensure_ascii=False) + "\n"
+            for url, public_url in self._buffer
+        ))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._buffer.clear()
+
+    def compact(self, mappings: dict[str, str]):
+        """Flush, write the full snapshot, then truncate the log"""
+        with self._lock:
+            self._flush()
+            save_mappings(mappings)
+            self._file.close()
+            self._file = open(self.path, "w", encoding="utf-8")
+
+    def close(self):
+        """Flush pending entries and close the log file"""
+        with self._lock:
+            self._flush()
+            self._file.close()
+
+
 def is_already_migrated(url: str, mappings: dict[str, str]) -> bool:
     """Check if URL is already in mappings or is already a Supabase URL"""
     if not url:
         return True
-    if "supabase" in url:
+    if SUPABASE_HOST in url[:128]:
         return True
     return url in mappings
 
@@ -91,47 +206,163 @@ def get_supabase_client():
 
 
 # ============================================================================
-# Image Download
+# Connection Warm-up
 # ============================================================================
 
-def download_image(url: str, session: requests.Session) -> bytes | None:
-    """Download image from Moodle URL"""
+def prime_connections(session: requests.Session, client):
+    """
+    Open the Moodle and Supabase HTTPS connections before the first transfer,
+    so DNS + TCP + TLS setup is not paid by the first image. Errors are ignored.
+    """
+    try:
+        session.head(f"https://{MOODLE_HOST}/", timeout=5)
+    except requests.RequestException as e:
+        log.debug(f"Moodle warm-up failed: {e}")
+
     try:
-        response = session.get(url, timeout=30)
-        response.raise_for_status()
+        client.storage.from_(BUCKET_NAME).list("", {"limit": 1})
+    except Exception as e:
+        log.debug(f"Supabase warm-up failed: {e}")
+
+
+# ============================================================================
+# Image Download
+# ============================================================================
 
-        content_type = response.headers.get("content-type", "")
-        if "image" not in content_type and "octet-stream" not in content_type:
-            log.warning(f"Not an image response for {url}: {content_type}")
+def download_image(url: str, session: requests.Session,
+                   bucket: TokenBucket | None = None) -> tuple[bytes, str] | None:
+    """Download image from Moodle URL (retries on 429/503). Returns (data, content_type_header)"""
+    for attempt in range(MAX_DOWNLOAD_ATTEMPTS):
+        if bucket:
+            bucket.acquire()
+
+        try:
+            response = session.get(url, timeout=30)
+
+            if response.status_code in RETRY_STATUS_CODES:
+                delay = get_retry_delay(response, attempt)
+                log.warning(f"HTTP {response.status_code} for {url}, backing off {delay:.1f}s")
+                if bucket:
+                    bucket.throttle(delay)
+                else:
+                    time.sleep(delay)
+                continue
+
+            response.raise_for_status()
+
+            content_type = response.headers.get("content-type", "")
+            if "image" not in content_type and "octet-stream" not in content_type:
+                log.warning(f"Not an image response for {url}: {content_type}")
+                return None
+
+            return response.content, content_type.split(";")[0].strip()
+        except requests.RequestException as e:
+            log.error(f"Failed to download {url}: {e}")
             return None
 
-        return response.content
-    except requests.RequestException as e:
-        log.error(f"Failed to download {url}: {e}")
-        return None
+    log.error(f"Giving up on {url} after {MAX_DOWNLOAD_ATTEMPTS} attempts")
+    return None
+
+
+async def download_image_async(url: str, session, bucket: TokenBucket | None = None) -> tuple[bytes, str] | None:
+    """aiohttp version of download_image (same retry and content-type rules)"""
+    for attempt in range(MAX_DOWNLOAD_ATTEMPTS):
+        if bucket:
+            await bucket.acquire_async()
+
+        try:
+            async with session.get(url) as response:
+                if response.status in RETRY_STATUS_CODES:
+                    delay = get_retry_delay(response, attempt)
+                    log.warning(f"HTTP {response.status} for {url}, backing off {delay:.1f}s")
+                    if bucket:
+                        bucket.throttle(delay)
+                    else:
+                        await asyncio.sleep(delay)
+                    continue
+
+                response.raise_for_status()
+
+                content_type = response.headers.get("content-type", "")
+                if "image" not in content_type and "octet-stream" not in content_type:
+                    log.warning(f"Not an image response for {url}: {content_type}")
+                    return None
+
+                return await response.read(), content_type.split(";")[0].strip()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.error(f"Failed to download {url}: {e}")
+            return None
+
+    log.error(f"Giving up on {url} after {MAX_DOWNLOAD_ATTEMPTS} attempts")
+    return None
+
+
+def url_extension(url: str) -> str:
+    """File extension of the last URL path segment ("" if none), ignoring query/fragment"""
+    end = len(url)
+    for sep in "?#":
+        pos = url.find(sep)
+        if 0 <= pos < end:
+            end = pos
+
+    dot = url.rfind(".", url.rfind("/", 0, end) + 1, end)
+    if dot == -1 or end - dot > 6:
+        return ""
+    return url[dot:end]
+
 
+def sniff_mime(data: bytes) -> str | None:
+    """Detect image MIME type from magic bytes (None if unrecognized)"""
+    for signature, mime in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
 
-def extract_filename_from_url(url: str) -> str:
-    """Extract clean filename from Moodle URL"""
-    parsed = urlparse(url)
-    path = parsed.path
-    filename = path.split("/")[-1]
-    return filename
 
+def generate_storage_path(digest: str, original_url: str, mime: str | None = None) -> str:
+    """
+    Content-addressed storage path: identical images map to the same object.
+    The 2-char digest prefix avoids one huge flat directory.
+    Extension comes from the sniffed MIME type, else from the URL.
+    """
+    ext = MIME_EXTENSIONS.get(mime) or url_extension(original_url) or ".jpg"
+    return f"{digest[:2]}/{digest}{ext}"
 
-def generate_storage_path(question_id: str, image_index: int, original_url: str) -> str:
-    """Generate storage path for image"""
-    ext = Path(extract_filename_from_url(original_url)).suffix or ".jpg"
-    safe_id = re.sub(r'[^a-zA-Z0-9_-]', '_', question_id)
-    return f"{safe_id}_{image_index}{ext}"
+
+def build_digest_index(mappings: dict[str, str]) -> dict[str, str]:
+    """Map sha256 digest -> public URL for already-uploaded content-addressed objects"""
+    index = {}
+    for public_url in mappings.values():
+        match = CONTENT_PATH_RE.search(public_url)
+        if match:
+            index[match.group(2)] = public_url
+    return index
 
 
 # ============================================================================
 # Supabase Upload
 # ============================================================================
 
-def upload_to_supabase(client, file_path: str, image_data: bytes, content_type: str = "image/jpeg") -> str | None:
-    """Upload image to Supabase Storage and return public URL"""
+def build_public_url(file_path: str) -> str:
+    """Public URL of an object in the bucket (same format as the SDK's get_public_url)"""
+    return PUBLIC_URL_PREFIX + quote(file_path, safe="/_-.")
+
+
+def public_url_format_matches(client) -> bool:
+    """Check once that build_public_url agrees with the SDK"""
+    probe = "probe_1.jpg"
+    sdk_url = client.storage.from_(BUCKET_NAME).get_public_url(probe).rstrip("?")
+    return sdk_url == build_public_url(probe)
+
+
+def upload_to_supabase(client, file_path: str, image_data: bytes, content_type: str = "image/jpeg",
+                       verify: bool = False) -> str | None:
+    """
+    Upload image to Supabase Storage and return public URL.
+    With verify=True the URL comes from the SDK and mismatches are logged.
+    """
     try:
         client.storage.from_(BUCKET_NAME).upload(
             file_path,
@@ -139,7 +370,15 @@ def upload_to_supabase(client, file_path: str, image_data: bytes, content_type:
             {"content-type": content_type, "upsert": "true"}
         )
 
-        public_url = client.storage.from_(BUCKET_NAME).get_public_url(file_path)
+        public_url = build_public_url(file_path)
+        if verify:
+            sdk_url = client.storage.from_(BUCKET_NAME).get_public_url(file_path)
+            # The SDK may append a bare "?": strip it so stored URLs stay parseable by CONTENT_PATH_RE
+            sdk_url = sdk_url.rstrip("?")
+            if sdk_url != public_url:
+                log.warning(f"Public URL mismatch: {public_url} != {sdk_url}")
+            public_url = sdk_url
+
         return public_url
 
     except Exception as e:
@@ -147,6 +386,74 @@ def upload_to_supabase(client, file_path: str, image_data: bytes, content_type:
         return None
 
 
+def store_image(client, image_url: str, image_data: bytes, header_type: str,
+                digest_index: dict[str, str], verify: bool = False) -> tuple[str | None, bool]:
+    """
+    Upload downloaded bytes unless identical content is already in the bucket.
+    Returns (public_url or None, reused).
+    """
+    digest = hashlib.sha256(image_data).hexdigest()
+    public_url = digest_index.get(digest)
+    if public_url:
+        return public_url, True
+
+    # Content type from magic bytes, else what Moodle claimed
+    mime = sniff_mime(image_data)
+    content_type = mime or header_type or "application/octet-stream"
+    storage_path = generate_storage_path(digest, image_url, mime)
+    public_url = upload_to_supabase(client, storage_path, image_data, content_type, verify=verify)
+    if public_url:
+        digest_index[digest] = public_url
+    return public_url, False
+
+
+async def process_pending_async(pending_images: list[PendingImage], client, bucket: TokenBucket,
+                                digest_index: dict[str, str], verify: bool, stats: dict, record,
+                                uses_by_url: Counter):
+    """
+    Download all pending images concurrently with aiohttp (bounded by a semaphore).
+    Uploads run on the default thread pool since supabase-py is synchronous;
+    record(url, public_url, reused) is always called on the event loop thread.
+    uses_by_url counts the question references behind each (deduplicated) URL.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+
+    cookie_jar = aiohttp.CookieJar()
+    cookie_jar.update_cookies({"MoodleSession": MOODLE_SESSION_COOKIE}, URL(f"https://{MOODLE_HOST}/"))
+    connector = aiohttp.TCPConnector(
+        limit=DOWNLOAD_CONCURRENCY,
+        limit_per_host=DOWNLOAD_CONCURRENCY_PER_HOST,
+        keepalive_timeout=60,
+    )
+
+    async def process_one(image: PendingImage):
+        async with semaphore:
+            downloaded = await download_image_async(image.url, session, bucket)
+
+        stats["total"] += 1
+        shared = uses_by_url[image.url] - 1
+        log.info(f"[{stats['total']}/{len(pending_images)}] {image.question_id} image {image.index}"
+                 + (f" (+{shared} other references)" if shared else ""))
+        if not downloaded:
+            stats["failed"] += 1
+            return
+        stats["downloaded"] += 1
+
+        public_url, reused = await loop.run_in_executor(
+            None, store_image, client, image.url, *downloaded, digest_index, verify
+        )
+        record(image.url, public_url, reused)
+
+    async with aiohttp.ClientSession(
+        connector=connector,
+        cookie_jar=cookie_jar,
+        headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"},
+        timeout=aiohttp.ClientTimeout(total=30),
+    ) as session:
+        await asyncio.gather(*(process_one(image) for image in pending_images))
+
+
 # ============================================================================
 # Status Report
 # ============================================================================
@@ -157,58 +464,64 @@ def show_status():
 
     assert QUESTIONS_FILE.exists(), f"Questions file not found: {QUESTIONS_FILE}"
 
-    with open(QUESTIONS_FILE, "r", encoding="utf-8") as f:
-        questions = json.load(f)
+    questions = read_json(QUESTIONS_FILE)
 
     mappings = load_mappings()
 
-    # Collect all image URLs
-    all_urls = []
+    # Categorize every image URL in a single pass
+    n_total = n_supabase = n_mapped = n_pending = 0
+    pending_sample = []
+    in_mappings = mappings.__contains__
+
     for q in questions:
         for url in q.get("images", []):
-            if url:
-                all_urls.append(url)
-
-    # Categorize
-    already_supabase = [u for u in all_urls if "supabase" in u]
-    in_mappings = [u for u in all_urls if u in mappings and "supabase" not in u]
-    pending = [u for u in all_urls if not is_already_migrated(u, mappings)]
+            if not url:
+                continue
+            n_total += 1
+            if SUPABASE_HOST in url[:128]:
+                n_supabase += 1
+            elif in_mappings(url):
+                n_mapped += 1
+            else:
+                n_pending += 1
+                if len(pending_sample) < 5:
+                    pending_sample.append(url)
 
     print(f"\n{'='*60}")
     print("IMAGE MIGRATION STATUS")
     print(f"{'='*60}")
     print(f"Questions file: {QUESTIONS_FILE}")
     print(f"Mappings file:  {MAPPINGS_FILE}")
-    print(f"\nTotal images in questions: {len(all_urls)}")
-    print(f"  Already Supabase URLs:   {len(already_supabase)}")
-    print(f"  In mappings file:        {len(in_mappings)}")
-    print(f"  Pending migration:       {len(pending)}")
+    print(f"\nTotal images in questions: {n_total}")
+    print(f"  Already Supabase URLs:   {n_supabase}")
+    print(f"  In mappings file:        {n_mapped}")
+    print(f"  Pending migration:       {n_pending}")
     print(f"\nMappings file entries:     {len(mappings)}")
     print(f"{'='*60}\n")
 
-    if pending:
+    if pending_sample:
         print(f"Sample pending URLs (first 5):")
-        for url in pending[:5]:
+        for url in pending_sample:
             print(f"  {url[:80]}...")
 
-    return {"total": len(all_urls), "pending": len(pending), "migrated": len(in_mappings) + len(already_supabase)}
+    return {"total": n_total, "pending": n_pending, "migrated": n_mapped + n_supabase}
 
 
 # ============================================================================
 # Main Migration
 # ============================================================================
 
-def migrate_images(test_mode: bool = False, limit: int = 5):
+def migrate_images(test_mode: bool = False, limit: int = 5, verify: bool = False, use_async: bool = False):
     """Migrate pending images from Moodle to Supabase (incremental)"""
 
     assert MOODLE_SESSION_COOKIE, "MOODLE_SESSION cookie not set. Get it from browser DevTools."
+    assert not use_async or aiohttp is not None, "--async requires aiohttp (pip install aiohttp)"
 
     # Load questions (read-only, we never modify this file)
     log.info(f"Loading questions from {QUESTIONS_FILE}")
     assert QUESTIONS_FILE.exists(), f"Questions file not found: {QUESTIONS_FILE}"
 
-    with open(QUESTIONS_FILE, "r", encoding="utf-8") as f:
-        questions = json.load(f)
+    questions = read_json(QUESTIONS_FILE)
 
     # Load existing mappings
     mappings = load_mappings()
@@ -216,7 +529,7 @@ def migrate_images(test_mode: bool = False, limit: int = 5):
 
     # Setup HTTP session with Moodle cookies
     session = requests.Session()
-    session.cookies.set("MoodleSession", MOODLE_SESSION_COOKIE, domain="cursosonline.doctorguevara.cl")
+    session.cookies.set("MoodleSession", MOODLE_SESSION_COOKIE, domain=MOODLE_HOST)
     session.headers.update({
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
     })
@@ -224,22 +537,35 @@ def migrate_images(test_mode: bool = False, limit: int = 5):
     # Setup Supabase client
     supabase = get_supabase_client()
 
-    # Track statistics
-    stats = {"total": 0, "downloaded": 0, "uploaded": 0, "failed": 0, "skipped": 0}
+    if not verify and not public_url_format_matches(supabase):
+        log.warning("Local public URL format differs from the SDK; using get_public_url for every upload")
+        verify = True
 
-    # Collect pending images
-    pending_images = []
-    for q in questions:
-        question_id = q["question_id"]
-        for idx, image_url in enumerate(q.get("images", []), 1):
-            if not is_already_migrated(image_url, mappings):
-                pending_images.append({
-                    "question_id": question_id,
-                    "index": idx,
-                    "url": image_url
-                })
+    # Adaptive rate limiter for Moodle downloads
+    bucket = TokenBucket(DOWNLOAD_RATE, DOWNLOAD_BURST)
 
-    log.info(f"Found {len(pending_images)} pending images to migrate")
+    # Track statistics
+    stats = {"total": 0, "downloaded": 0, "uploaded": 0, "reused": 0, "failed": 0, "skipped": 0}
+
+    # Collect pending images (inlined is_already_migrated: host prefix + dict lookup)
+    supabase_host = SUPABASE_HOST
+    pending_images = [
+        PendingImage(q["question_id"], idx, url)
+        for q in questions
+        for idx, url in enumerate(q.get("images") or (), 1)
+        if url and supabase_host not in url[:128] and url not in mappings
+    ]
+
+    # The same Moodle URL can appear in several questions: mappings are keyed
+    # by URL, so download/upload each URL once
+    uses_by_url = Counter(img.url for img in pending_images)
+    first_by_url = {}
+    for img in pending_images:
+        first_by_url.setdefault(img.url, img)
+    pending_images = list(first_by_url.values())
+
+    log.info(f"Found {len(uses_by_url)} unique pending images to migrate "
+             f"({sum(uses_by_url.values())} references)")
 
     if test_mode:
         pending_images = pending_images[:limit]
@@ -249,37 +575,51 @@ def migrate_images(test_mode: bool = False, limit: int = 5):
         log.info("No pending images to migrate!")
         return stats
 
-    # Process each pending image
-    for i, img in enumerate(pending_images, 1):
-        stats["total"] += 1
-        question_id = img["question_id"]
-        idx = img["index"]
-        image_url = img["url"]
+    prime_connections(session, supabase)
 
-        log.info(f"[{i}/{len(pending_images)}] {question_id} image {idx}")
+    # Process each pending image
+    digest_index = build_digest_index(mappings)
+    mapping_log = MappingLog()
 
-        # Download
-        image_data = download_image(image_url, session)
-        if not image_data:
+    def record(image_url: str, public_url: str | None, reused: bool):
+        if not public_url:
             stats["failed"] += 1
-            continue
-        stats["downloaded"] += 1
+            return
+        stats["reused" if reused else "uploaded"] += 1
 
-        # Upload
-        storage_path = generate_storage_path(question_id, idx, image_url)
-        public_url = upload_to_supabase(supabase, storage_path, image_data)
+        # Add to mappings and to the batched append log (resume-safe)
+        mappings[image_url] = public_url
+        mapping_log.add(image_url, public_url)
+        log.info(f"  -> {public_url}")
 
-        if public_url:
-            stats["uploaded"] += 1
-            # Add to mappings and save immediately (resume-safe)
-            mappings[image_url] = public_url
-            save_mappings(mappings)
-            log.info(f"  -> {public_url}")
+        if (stats["uploaded"] + stats["reused"]) % COMPACT_EVERY == 0:
+            mapping_log.compact(mappings)
+
+    try:
+        if use_async:
+            asyncio.run(process_pending_async(pending_images, supabase, bucket, digest_index, verify, stats, record,
+                                              uses_by_url))
         else:
-            stats["failed"] += 1
+            for i, (question_id, idx, image_url) in enumerate(pending_images, 1):
+                stats["total"] += 1
+
+                shared = uses_by_url[image_url] - 1
+                log.info(f"[{i}/{len(pending_images)}] {question_id} image {idx}"
+                         + (f" (+{shared} other references)" if shared else ""))
+
+                # Download
+                downloaded = download_image(image_url, session, bucket)
+                if not downloaded:
+                    stats["failed"] += 1
+                    continue
+                stats["downloaded"] += 1
+
+                # Identical bytes already in the bucket are reused without uploading
+                record(image_url, *store_image(supabase, image_url, *downloaded, digest_index, verify))
 
-        # Rate limiting
-        time.sleep(0.2)
+        mapping_log.compact(mappings)
+    finally:
+        mapping_log.close()
 
     # Print summary
     log.info("=" * 60)
@@ -287,6 +627,7 @@ def migrate_images(test_mode: bool = False, limit: int = 5):
     log.info(f"  Processed:    {stats['total']}")
     log.info(f"  Downloaded:   {stats['downloaded']}")
     log.info(f"  Uploaded:     {stats['uploaded']}")
+    log.info(f"  Reused:       {stats['reused']} (identical content)")
     log.info(f"  Failed:       {stats['failed']}")
     log.info(f"  Total mapped: {len(mappings)}")
     log.info("=" * 60)
@@ -306,13 +647,16 @@ if __name__ == "__main__":
     parser.add_argument("--limit", type=int, default=5, help="Number of images to process in test mode")
     parser.add_argument("--full", action="store_true", help="Process all pending images")
     parser.add_argument("--status", action="store_true", help="Show migration status only")
+    parser.add_argument("--verify", action="store_true", help="Cross-check public URLs against the Supabase SDK")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Download concurrently with aiohttp (uploads stay on threads)")
 
     args = parser.parse_args()
 
     if args.status:
         show_status()
     elif args.full or args.test:
-        migrate_images(test_mode=args.test, limit=args.limit)
+        migrate_images(test_mode=args.test, limit=args.limit, verify=args.verify, use_async=args.use_async)
     else:
         print("Usage:")
         print("  Status:     python migrate_images_to_supabase.py --status")
@@ -0,0 +1,61 @@
+"""
+Rate limiting and retry back-off for image downloads from Moodle.
+Shared by migrate_images_to_supabase.py and classification/merge_topics.py.
+"""
+
+import asyncio
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter.
+    Allows `burst` requests up front, then refills at `rate` per second.
+    throttle() pauses all callers, e.g. when the server answers 429/503.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = float(burst)
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """Take a token if available. Returns 0, or the seconds to wait before trying again"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while (wait := self._take()) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Wait (without blocking the event loop) until a request may be sent"""
+        while (wait := self._take()) > 0:
+            await asyncio.sleep(wait)
+
+    def throttle(self, seconds: float):
+        """Pause all requests for the given number of seconds"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+def get_retry_delay(response, attempt: int) -> float:
+    """Seconds to wait before retrying: Retry-After header, else exponential backoff with jitter"""
+    retry_after = response.headers.get("retry-after", "")
+    if retry_after.isdigit():
+        return float(retry_after)
+    return 2 ** attempt + random.uniform(0, 0.5)
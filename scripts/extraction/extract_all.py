@@ -7,21 +7,27 @@ This script:
 4. Outputs questions_ready.json ready for database import
 """
 from pathlib import Path
-import json
+import os
 from collections import Counter
 from extract_mi_eunacom import extract_all_mi_eunacom
 from extract_mi_eunacom_topics import extract_all_mi_eunacom_topics
 from extract_guevara import extract_all_guevara
 from extract_reconstrucciones import extract_all_reconstrucciones
-from utils import save_questions, print_extraction_summary
+from utils import save_questions, print_extraction_summary, read_json, write_json_records
 from config import get_raw_data_root, get_processed_data_root
 
+try:
+    import ijson  # Picks its fastest backend (yajl2_c) automatically
+except ImportError:
+    ijson = None  # Fall back to loading the whole file
+
 
 # ============================================================================
 # Valid Topics (24 categories)
 # ============================================================================
 
-VALID_TOPICS = [
+# frozenset: enrich_topics checks membership once per question that already has a topic
+VALID_TOPICS = frozenset({
     "Gastroenterología",
     "Nefrología",
     "Cardiología",
@@ -46,26 +52,21 @@ VALID_TOPICS = [
     "Ginecología",
     "Pediatría",
     "Medicina Legal",
-]
+})
 
 
 def merge_and_deduplicate(questions_list: list[list[dict]]) -> list[dict]:
     """Merge multiple question lists and remove duplicates"""
-    all_questions = []
+    # Deduplicate by question_text (fuzzy match could be added later).
+    # First occurrence of each key wins; no merged intermediate list is built
+    unique_by_text = {}
     for questions in questions_list:
-        all_questions.extend(questions)
-
-    # Deduplicate by question_text (fuzzy match could be added later)
-    seen_texts = set()
-    unique_questions = []
+        for q in questions:
+            unique_by_text.setdefault(q["question_text"][:100].strip().lower(), q)
 
-    for q in all_questions:
-        text_key = q["question_text"][:100].strip().lower()
-        if text_key not in seen_texts:
-            seen_texts.add(text_key)
-            unique_questions.append(q)
+    unique_questions = list(unique_by_text.values())
 
-    duplicates = len(all_questions) - len(unique_questions)
+    duplicates = sum(map(len, questions_list)) - len(unique_questions)
     if duplicates > 0:
         print(f"\n⚠️  Removed {duplicates} cross-source duplicates")
 
@@ -85,17 +86,28 @@ def load_historical_topics(processed_dir: Path) -> dict[str, str]:
         print(f"ℹ️  Historical file not found: {historical_file.name} (optional)")
         return {}
 
-    with open(historical_file, "r", encoding="utf-8") as f:
-        historical = json.load(f)
-
-    assert isinstance(historical, list), "Historical file must be a list"
-
-    # Create dict with question_id -> topic
-    historical_dict = {
-        q["question_id"]: q.get("topic", "")
-        for q in historical
-        if q.get("question_id")
-    }
+    if ijson is not None:
+        # Stream records: only question_id -> topic is kept, never the full list
+        historical_dict = {}
+        with open(historical_file, "rb") as f:
+            # "item" matches nothing under a top-level object, so check the shape first
+            _, first_event, _ = next(ijson.parse(f))
+            assert first_event == "start_array", "Historical file must be a list"
+            f.seek(0)
+            for q in ijson.items(f, "item"):
+                if q.get("question_id"):
+                    historical_dict[q["question_id"]] = q.get("topic", "")
+    else:
+        historical = read_json(historical_file)
+
+        assert isinstance(historical, list), "Historical file must be a list"
+
+        # Create dict with question_id -> topic
+        historical_dict = {
+            q["question_id"]: q.get("topic", "")
+            for q in historical
+            if q.get("question_id")
+        }
 
     print(f"✅ Loaded {len(historical_dict)} historical topics from {historical_file.name}")
     return historical_dict
@@ -112,53 +124,57 @@ def enrich_topics(questions: list[dict], historical_topics: dict[str, str]) -> t
 
     Returns: (enriched_questions, stats_dict)
     """
-    stats = {
-        "already_had_topic": 0,
-        "matched_from_historical": 0,
-        "still_unclassified": 0,
-    }
+    # Plain local counters in the loop; the stats dict is built once at the end
+    already_had_topic = matched_from_historical = still_unclassified = 0
+    unclassified = "Sin clasificar"
+    historical_get = historical_topics.get
 
     for q in questions:
         q_id = q.get("question_id", "")
         current_topic = q.get("topic", "").strip()
 
-        # Priority 1: Keep existing topic
+        # Priority 1: Keep existing topic (the check is an assert, so python -O skips it)
         if current_topic:
             assert current_topic in VALID_TOPICS, \
                 f"Question {q_id} has invalid topic: '{current_topic}'"
-            stats["already_had_topic"] += 1
+            already_had_topic += 1
             continue
 
-        # Priority 2: Use historical topic
-        if q_id in historical_topics and historical_topics[q_id]:
-            q["topic"] = historical_topics[q_id]
-            stats["matched_from_historical"] += 1
+        # Priority 2: Use historical topic (one lookup; missing and empty both fall through)
+        historical_topic = historical_get(q_id)
+        if historical_topic:
+            q["topic"] = historical_topic
+            matched_from_historical += 1
             continue
 
         # Priority 3: Mark as unclassified
-        q["topic"] = "Sin clasificar"
-        stats["still_unclassified"] += 1
+        q["topic"] = unclassified
+        still_unclassified += 1
 
+    stats = {
+        "already_had_topic": already_had_topic,
+        "matched_from_historical": matched_from_historical,
+        "still_unclassified": still_unclassified,
+    }
     return questions, stats
 
 
 def print_topic_distribution(questions: list[dict]):
     """Print distribution of topics across all questions"""
-    topics = [q.get("topic", "Sin clasificar") for q in questions]
-    topic_counts = Counter(topics)
+    topic_counts = Counter(q.get("topic", "Sin clasificar") for q in questions)
+    total = len(questions)
 
-    print(f"\n{'='*60}")
-    print("TOPIC DISTRIBUTION")
-    print(f"{'='*60}")
+    lines = [f"\n{'='*60}", "TOPIC DISTRIBUTION", f"{'='*60}"]
 
-    # Sort by count descending
-    for topic, count in sorted(topic_counts.items(), key=lambda x: -x[1]):
-        pct = (count / len(questions)) * 100
+    # most_common() is count descending, ties in first-seen order
+    for topic, count in topic_counts.most_common():
+        pct = (count / total) * 100
         bar_length = int(pct / 2)  # Scale to 50 chars max
         bar = "#" * bar_length
-        print(f"{topic:25s} | {count:4d} ({pct:5.1f}%) {bar}")
+        lines.append(f"{topic:25s} | {count:4d} ({pct:5.1f}%) {bar}")
 
-    print(f"{'='*60}")
+    lines.append(f"{'='*60}")
+    print("\n".join(lines))
 
 
 def main():
@@ -214,8 +230,9 @@ def main():
     # Save final output as questions_ready.json
     output_file = processed_dir / "questions_ready.json"
     output_file.parent.mkdir(parents=True, exist_ok=True)
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(all_questions, f, ensure_ascii=False, indent=2)
+    temp_file = output_file.with_suffix(".json.tmp")
+    write_json_records(temp_file, all_questions)
+    os.replace(temp_file, output_file)
 
     print(f"\nSaved: {output_file}")
 
@@ -242,4 +259,12 @@ def main():
 
 
 if __name__ == "__main__":
+    import argparse
+    import logging
+
+    parser = argparse.ArgumentParser(description="Run all extractors, merge, enrich topics")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show per-file progress")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(message)s")
     main()
@@ -1,39 +1,115 @@
 """Extract questions from GUEVARA HTML files - WITH IMAGE SUPPORT"""
 
-from bs4 import BeautifulSoup
+from lxml import etree
+import io
+import logging
 from pathlib import Path
 import re
-from utils import save_questions, print_extraction_summary
+from utils import (
+    save_questions, print_extraction_summary, extract_from_view_source, is_view_source, map_files, Question
+)
 from config import get_raw_data_root
 
+# Per-file progress goes to DEBUG (extract_all.py -v); one summary line is printed per source
+log = logging.getLogger(__name__)
+
+
+# Question div matching
+QUESTION_DIV_ID_RE = re.compile(r"question-\d+-\d+")
+
+
+def is_question_class(value: str | None) -> bool:
+    """Same test as re.search(r"que.*multichoice", value), with two str.find calls"""
+    if not value:
+        return False
+    start = value.find("que")
+    return start != -1 and value.find("multichoice", start + 3) != -1
+
 
 # ============================================================================
-# Image Extraction
+# XPath Queries (compiled once, evaluated by libxml2)
 # ============================================================================
 
-def extract_images_from_element(element) -> list[str]:
+def has_class(name: str) -> str:
+    """XPath predicate: @class contains `name` as a whole word (like BeautifulSoup's class_=)"""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+X_QNO = etree.XPath(f".//span[{has_class('qno')}]")
+X_QTEXT = etree.XPath(f".//div[{has_class('qtext')}]")
+X_ANSWERS = etree.XPath(f".//div[{has_class('r0')} or {has_class('r1')}]")
+X_LABEL = etree.XPath(f".//div[{has_class('d-flex')}]")
+X_LETTER = etree.XPath(f".//span[{has_class('answernumber')}]")
+X_OPTION_TEXT = etree.XPath(f".//div[{has_class('flex-fill')}]")
+X_FEEDBACK = etree.XPath(f".//div[{has_class('generalfeedback')}]")
+X_IMG_SRC = etree.XPath(".//img/@src")
+
+# Visible text only: like bs4's get_text, skip <script>/<style>/<template> contents
+VISIBLE_TEXT = "not(ancestor::script) and not(ancestor::style) and not(ancestor::template)"
+
+X_TEXT = etree.XPath(f".//text()[{VISIBLE_TEXT}]")
+# Text outside any <table> nested inside the context node
+X_TEXT_OUTSIDE_TABLES = etree.XPath(f".//text()[{VISIBLE_TEXT} and count(ancestor::table) = $depth]")
+X_TABLE_DEPTH = etree.XPath("count(ancestor::table)")
+
+
+def iter_question_elements(source):
     """
-    Extract all image URLs from an HTML element
-    Returns list of image URLs (can be empty)
+    Yield (div, matches_id, matches_class) for each question div as soon as its end tag is parsed.
+    source is a file path or a binary file object.
+    Finished top-level question divs are cleared after the caller is done with them,
+    so the tree only ever holds one question plus the page skeleton.
     """
-    if element is None:
-        return []
-    
-    images = []
-    for img in element.find_all("img"):
-        src = img.get("src", "")
-        if src:
-            images.append(src)
-    
-    return images
+    open_matches = 0  # Matching divs started but not yet ended (nested matches stay intact)
+
+    # huge_tree lifts libxml2's text-node/depth limits, which large rejoined view-source pages can hit
+    for event, div in etree.iterparse(
+        source,
+        events=("start", "end"), tag="div", html=True, encoding="utf-8", huge_tree=True,
+    ):
+        matches_id = QUESTION_DIV_ID_RE.search(div.get("id", "")) is not None
+        matches_class = is_question_class(div.get("class"))
+        if not (matches_id or matches_class):
+            continue
+
+        if event == "start":
+            open_matches += 1
+            continue
+
+        open_matches -= 1
+        yield div, matches_id, matches_class
+
+        if open_matches == 0:
+            div.clear(keep_tail=True)
+            while div.getprevious() is not None:
+                del div.getparent()[0]
+
+
+def page_source(filepath: Path):
+    """iterparse input for a page: the path itself, or the rejoined inner page of a view-source file"""
+    if is_view_source(filepath):
+        # Handle view-source format (only the rejoined inner page is parsed)
+        return io.BytesIO(extract_from_view_source(filepath).encode("utf-8"))
+    # Plain pages: libxml2 reads the file itself, no copy of it is held as a Python str
+    return str(filepath)
+
+
+def first(nodes: list):
+    """First XPath match or None"""
+    return nodes[0] if nodes else None
+
+
+def join_text(strings, separator: str = "") -> str:
+    """Same result as BeautifulSoup get_text(strip=True, separator=...)"""
+    return separator.join(text for text in (s.strip() for s in strings) if text)
 
 
 # ============================================================================
 # Question Extraction
 # ============================================================================
 
-def extract_question(question_div, source_filename: str) -> dict | None:
-    """Extract single question from GUEVARA HTML - WITH IMAGE SUPPORT"""
+def extract_question(question_div, source_filename: str) -> Question | None:
+    """Extract single question from a GUEVARA lxml element - WITH IMAGE SUPPORT"""
     try:
         # Question ID
         question_id = question_div.get("id", "")
@@ -41,40 +117,36 @@ def extract_question(question_div, source_filename: str) -> dict | None:
             return None
 
         # Question number (remove "Pregunta" prefix)
-        qno_span = question_div.find("span", class_="qno")
-        q_number = qno_span.get_text(strip=True).replace("Pregunta ", "") if qno_span else ""
+        qno_span = first(X_QNO(question_div))
+        q_number = join_text(X_TEXT(qno_span)).replace("Pregunta ", "") if qno_span is not None else ""
 
         # Question text div
-        qtext_div = question_div.find("div", class_="qtext")
-        
-        # FIXED: Extract images BEFORE stripping HTML
-        images = extract_images_from_element(qtext_div)
-        
-        # Now extract text
-        if qtext_div:
-            qtext_copy = qtext_div.__copy__()
-            for table in qtext_copy.find_all("table"):
-                table.decompose()
-            q_text = qtext_copy.get_text(strip=True, separator=" ")
+        qtext_div = first(X_QTEXT(question_div))
+
+        if qtext_div is not None:
+            # Images come from the whole qtext, tables included
+            images = [src for src in X_IMG_SRC(qtext_div) if src]
+            # Text skips nested tables (no copy/decompose needed)
+            depth = int(X_TABLE_DEPTH(qtext_div))
+            q_text = join_text(X_TEXT_OUTSIDE_TABLES(qtext_div, depth=depth), " ")
         else:
+            images = []
             q_text = ""
 
         # Answer options
-        answer_divs = question_div.find_all("div", class_=re.compile(r"^r[0-1]$"))
-
         all_options = []
         correct_answer = None
 
-        for ans_div in answer_divs:
-            label = ans_div.find("div", class_="d-flex")
-            if label:
-                letter_span = label.find("span", class_="answernumber")
-                text_div = label.find("div", class_="flex-fill")
+        for ans_div in X_ANSWERS(question_div):
+            label = first(X_LABEL(ans_div))
+            if label is not None:
+                letter_span = first(X_LETTER(label))
+                text_div = first(X_OPTION_TEXT(label))
 
-                if letter_span and text_div:
-                    letter = letter_span.get_text(strip=True)
-                    text = text_div.get_text(strip=True)
-                    is_correct = "correct" in ans_div.get("class", [])
+                if letter_span is not None and text_div is not None:
+                    letter = join_text(X_TEXT(letter_span))
+                    text = join_text(X_TEXT(text_div))
+                    is_correct = "correct" in ans_div.get("class", "").split()
 
                     all_options.append({
                         "letter": letter,
@@ -87,8 +159,8 @@ def extract_question(question_div, source_filename: str) -> dict | None:
                         correct_answer = f"{letter} {text}"
 
         # General explanation (topic-level)
-        feedback_div = question_div.find("div", class_="generalfeedback")
-        explanation = feedback_div.get_text(strip=True, separator=" ") if feedback_div else ""
+        feedback_div = first(X_FEEDBACK(question_div))
+        explanation = join_text(X_TEXT(feedback_div), " ") if feedback_div is not None else ""
 
         return {
             "question_id": question_id,
@@ -110,43 +182,35 @@ def extract_question(question_div, source_filename: str) -> dict | None:
 
 def extract_from_file(filepath: Path) -> list[dict]:
     """Extract all questions from one GUEVARA file"""
-    print(f"  Processing: {filepath.name}")
-
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            html_content = f.read()
+        if filepath.stat().st_size == 0:
+            log.debug(f"  {filepath.name}: empty file")
+            return []
 
-        # Handle view-source format
-        soup_viewsource = BeautifulSoup(html_content, "html.parser")
-        line_contents = soup_viewsource.find_all("td", class_="line-content")
-
-        if line_contents:
-            actual_html_lines = [line_td.get_text() for line_td in line_contents]
-            actual_html = "\n".join(actual_html_lines)
-            soup = BeautifulSoup(actual_html, "html.parser")
-        else:
-            soup = soup_viewsource
+        # Find questions: divs with a question-N-M id, else (no such div at all) by class
+        found_by_id = False
+        questions_by_id = []
+        questions_by_class = []
 
-        # Find questions
-        questions_divs = soup.find_all("div", id=re.compile(r"question-\d+-\d+"))
-
-        if not questions_divs:
-            questions_divs = soup.find_all("div", class_=re.compile(r"que.*multichoice"))
-
-        questions = []
-        for question_div in questions_divs:
+        for question_div, matches_id, matches_class in iter_question_elements(page_source(filepath)):
+            found_by_id = found_by_id or matches_id
             question = extract_question(question_div, filepath.name)
             if question:
-                questions.append(question)
+                if matches_id:
+                    questions_by_id.append(question)
+                if matches_class:
+                    questions_by_class.append(question)
+
+        questions = questions_by_id if found_by_id else questions_by_class
 
         # Count questions with images
         with_images = sum(1 for q in questions if q.get("images"))
-        print(f"    ✓ Extracted {len(questions)} questions ({with_images} with images)")
+        log.debug(f"  {filepath.name}: {len(questions)} questions ({with_images} with images)")
         
         return questions
 
     except Exception as e:
-        print(f"    ✗ Error: {str(e)}")
+        print(f"  ✗ Error in {filepath.name}: {str(e)}")
         return []
 
 
@@ -166,22 +230,20 @@ def extract_all_guevara() -> list[dict]:
     print(f"{'='*60}")
     print(f"Files found: {len(html_files)}\n")
 
-    all_questions = []
+    # Duplicates are dropped as results arrive (first occurrence of each question_id wins)
+    unique_by_id = {}
+    total_questions = 0
 
-    for html_file in html_files:
-        questions = extract_from_file(html_file)
-        all_questions.extend(questions)
+    # Files are independent and parsing is CPU-bound: one process per core
+    for questions in map_files(extract_from_file, html_files):
+        total_questions += len(questions)
+        for q in questions:
+            unique_by_id.setdefault(q["question_id"], q)
 
-    # Remove duplicates
-    seen_ids = set()
-    unique_questions = []
-    for q in all_questions:
-        qid = q["question_id"]
-        if qid not in seen_ids:
-            seen_ids.add(qid)
-            unique_questions.append(q)
+    unique_questions = list(unique_by_id.values())
+    print(f"Processed {len(html_files)} files, {total_questions} questions")
 
-    duplicates = len(all_questions) - len(unique_questions)
+    duplicates = total_questions - len(unique_questions)
     if duplicates > 0:
         print(f"\n⚠️  Removed {duplicates} duplicates")
 
@@ -197,5 +259,6 @@ def extract_all_guevara() -> list[dict]:
 if __name__ == "__main__":
     questions = extract_all_guevara()
     if questions:
-        output_file = save_questions(questions, "guevara")
+        # Already validated by print_extraction_summary inside the extractor
+        output_file = save_questions(questions, "guevara", validate=False)
         print(f"\n💾 Saved: {output_file}")
@@ -1,12 +1,36 @@
 """Extract questions from MI_EUNACOM HTML files - WITH IMAGE SUPPORT"""
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer, Tag
 import html as html_module
+import logging
 from pathlib import Path
 import re
-from utils import save_questions, print_extraction_summary
+from utils import (
+    save_questions, print_extraction_summary, extract_from_view_source, map_files, list_html_files,
+    HTML_PARSER, Question, AnswerOption,
+)
 from config import get_raw_data_root
 
+# Per-file progress goes to DEBUG (extract_all.py -v); one summary line is printed per source
+log = logging.getLogger(__name__)
+
+
+# Precompiled patterns (answer parsing runs once per <li>, question lookup once per item)
+# "a." ... "z." for options that carry no letter of their own (indexed by position)
+FALLBACK_LETTERS = [f"{chr(97 + i)}." for i in range(26)]
+# "a) Short text (correcta): Explanation" in one pass: letter, short text, explanation
+OPTION_RE = re.compile(
+    r"^(?:((?-i:[a-e]))\)\s*)?(.*?)\s*\((?:correcta|incorrecta)\):\s*(.*)$", re.DOTALL | re.IGNORECASE
+)
+MARKER_STRIP_RE = re.compile(r"\s*\((correcta|incorrecta)\)", re.IGNORECASE)
+DUPLICATE_RE = re.compile(r"^(.+?)([a-e]\)|\s+)\s*\1$", re.IGNORECASE)
+QUESTION_TARGET_RE = re.compile("question_")
+QUESTION_ID_RE = re.compile(r"question_(\d+)")
+
+# Only accordion items (and their subtrees) are built; page chrome, scripts and nav are skipped.
+# The strainer sees the raw class string, so match "accordion-item" as a whole token.
+ACCORDION_STRAINER = SoupStrainer("div", class_=re.compile(r"(?:^|\s)accordion-item(?:\s|$)"))
+
 
 # ============================================================================
 # Image Extraction
@@ -30,29 +54,17 @@ def extract_images_from_element(element) -> list[str]:
 
 
 # ============================================================================
-# HTML Processing
+# Answer Option Parsing
 # ============================================================================
 
-def extract_from_view_source(filepath: Path) -> str:
-    """Extract HTML from view-source saved file"""
-    with open(filepath, "r", encoding="utf-8") as f:
-        content = f.read()
-
-    if "line-content" in content:
-        soup = BeautifulSoup(content, "html.parser")
-        lines = soup.find_all("td", class_="line-content")
-        html_parts = [line.get_text() for line in lines]
-        actual_html = "\n".join(html_parts)
-        return html_module.unescape(actual_html)
-
-    return content
+def fallback_letter(position: int) -> str:
+    """Letter of an unlettered option: table lookup, computed past "z." like chr(97 + i) always was"""
+    if position < len(FALLBACK_LETTERS):
+        return FALLBACK_LETTERS[position]
+    return f"{chr(97 + position)}."
 
 
-# ============================================================================
-# Answer Option Parsing
-# ============================================================================
-
-def parse_answer_options(soup: BeautifulSoup) -> list[dict]:
+def parse_answer_options(soup: BeautifulSoup) -> list[AnswerOption]:
     """
     Extract answer options - handles broken HTML structure
     """
@@ -62,7 +74,11 @@ def parse_answer_options(soup: BeautifulSoup) -> list[dict]:
     if not answer_list:
         return answers
 
-    for li in answer_list.find_all("li", recursive=False):
+    # Direct children only (same as find_all("li", recursive=False), without the matcher)
+    for li in answer_list.children:
+        if li.name != "li":
+            continue
+
         # Check if correct (green background)
         is_correct = False
         span = li.find("span", style=True)
@@ -77,45 +93,54 @@ def parse_answer_options(soup: BeautifulSoup) -> list[dict]:
         full_text = label.get_text(strip=True)
 
         # Parse structure: "a) Short answer text (correcta/incorrecta): Detailed explanation"
-        letter_match = re.match(r"^([a-e])\)\s*", full_text)
-        if letter_match:
-            option_letter = letter_match.group(1) + "."
-            text_after_letter = full_text[len(letter_match.group(0)):].strip()
-        else:
-            option_letter = f"{chr(97 + len(answers))}."
-            text_after_letter = full_text
-
-        # Split on (correcta)/(incorrecta) marker followed by ":"
-        pattern = r"^(.*?)\s*\((correcta|incorrecta)\):\s*(.*)$"
-        match = re.match(pattern, text_after_letter, re.DOTALL | re.IGNORECASE)
+        match = OPTION_RE.match(full_text)
 
         if match:
-            short_text = match.group(1).strip()
-            detailed_explanation = match.group(3).strip()
+            letter, short_text, detailed_explanation = match.groups()
+            option_letter = f"{letter}." if letter else fallback_letter(len(answers))
+            short_text = short_text.strip()
+            detailed_explanation = detailed_explanation.strip()
+
+            # The marker itself is outside the group; strip only earlier stray markers
+            if "(" in short_text:
+                short_text = MARKER_STRIP_RE.sub("", short_text).strip()
         else:
+            # "a)" .. "e)" prefix, checked by hand (no regex needed for two characters)
+            if len(full_text) >= 2 and "a" <= full_text[0] <= "e" and full_text[1] == ")":
+                option_letter = full_text[0] + "."
+                text_after_letter = full_text[2:].strip()
+            else:
+                option_letter = fallback_letter(len(answers))
+                text_after_letter = full_text
+
             if ":" in text_after_letter:
-                parts = text_after_letter.split(":", 1)
-                short_text = re.sub(r"\s*\((correcta|incorrecta)\)", "", parts[0], flags=re.IGNORECASE).strip()
-                detailed_explanation = parts[1].strip()
+                short_text, detailed_explanation = text_after_letter.split(":", 1)
+                detailed_explanation = detailed_explanation.strip()
             else:
-                short_text = re.sub(r"\s*\((correcta|incorrecta)\)", "", text_after_letter, flags=re.IGNORECASE).strip()
+                short_text = text_after_letter
                 detailed_explanation = ""
 
-        # Clean up
-        short_text = re.sub(r"\s*\((correcta|incorrecta)\)", "", short_text, flags=re.IGNORECASE).strip()
+            # Most options have no marker at all: skip the regex scan then
+            if "(" in short_text:
+                short_text = MARKER_STRIP_RE.sub("", short_text)
+            short_text = short_text.strip()
 
         # Remove duplicate text patterns
-        duplicate_pattern = r"^(.+?)([a-e]\)|\s+)\s*\1$"
-        duplicate_match = re.match(duplicate_pattern, short_text, re.IGNORECASE)
+        duplicate_match = DUPLICATE_RE.match(short_text)
         if duplicate_match:
             short_text = duplicate_match.group(1).strip()
 
-        # Handle direct duplicates like "TextoTexto"
-        if len(short_text) % 2 == 0:
-            midpoint = len(short_text) // 2
+        # Handle direct duplicates like "TextoTexto": the first/last-char checks reject most options
+        # before any slicing, then one slice is compared in place against the second half
+        length = len(short_text)
+        midpoint = length // 2
+        if (
+            length and length % 2 == 0
+            and short_text[0] == short_text[midpoint]
+            and short_text[midpoint - 1] == short_text[-1]
+        ):
             first_half = short_text[:midpoint]
-            second_half = short_text[midpoint:]
-            if first_half == second_half and len(first_half) > 0:
+            if short_text.startswith(first_half, midpoint):
                 short_text = first_half
 
         answers.append({
@@ -132,53 +157,41 @@ def parse_answer_options(soup: BeautifulSoup) -> list[dict]:
 # Question Extraction
 # ============================================================================
 
-def extract_question(item_html: str, source_filename: str) -> dict | None:
+def extract_question(item: Tag, source_filename: str) -> Question | None:
     """Extract single question from HTML - WITH IMAGE SUPPORT"""
-    soup = BeautifulSoup(item_html, "html.parser")
-
     # Extract question ID
-    question_id = None
-    button = soup.find("button", {"data-bs-target": re.compile("question_")})
-    if button:
-        target = button.get("data-bs-target", "")
-        match = re.search(r"question_(\d+)", target)
-        if match:
-            question_id = match.group(1)
+    button = item.find("button", {"data-bs-target": QUESTION_TARGET_RE})
+    if not button or not (match := QUESTION_ID_RE.search(button.get("data-bs-target", ""))):
+        return None
+    question_id = match.group(1)
+
+    # Extract answer options (before the other fields: items without options are dropped)
+    answer_options = parse_answer_options(item)
 
-    if not question_id:
+    if not answer_options:
         return None
 
     # Extract question text
-    question_text = ""
-    if button:
-        bold = button.find("b")
-        if bold:
-            question_text = bold.get_text(strip=True)
+    bold = button.find("b")
+    question_text = bold.get_text(strip=True) if bold else ""
 
     # FIXED: Extract images from the question area
     # Look for images in the accordion item content
-    images = extract_images_from_element(soup)
+    images = extract_images_from_element(item)
 
     # Extract general explanation (topic-level, not option-level)
     explanation = ""
-    modal_body = soup.find("div", class_="modal-body")
+    modal_body = item.find("div", class_="modal-body")
     if modal_body:
         p_tag = modal_body.find("p")
         if p_tag:
-            explanation = p_tag.get_text(strip=True).replace("&quot;", "").strip('"')
-
-    # Extract answer options
-    answer_options = parse_answer_options(soup)
-
-    if not answer_options:
-        return None
+            # Text may still hold escaped entities (&quot;, &amp;, ...) from the saved page
+            explanation = html_module.unescape(p_tag.get_text(strip=True)).strip('"')
 
     # Find correct answer
-    correct_answer = ""
-    for opt in answer_options:
-        if opt["is_correct"]:
-            correct_answer = f"{opt['letter']} {opt['text']}"
-            break
+    correct_answer = next(
+        (f"{opt['letter']} {opt['text']}" for opt in answer_options if opt["is_correct"]), ""
+    )
 
     return {
         "question_id": question_id,
@@ -196,11 +209,9 @@ def extract_question(item_html: str, source_filename: str) -> dict | None:
 
 def extract_from_file(filepath: Path) -> list[dict]:
     """Extract all questions from one file"""
-    print(f"  Processing: {filepath.name}")
-
     try:
         html = extract_from_view_source(filepath)
-        soup = BeautifulSoup(html, "html.parser")
+        soup = BeautifulSoup(html, HTML_PARSER, parse_only=ACCORDION_STRAINER)
 
         accordion_items = soup.find_all("div", class_="gray-card accordion-item")
         if not accordion_items:
@@ -208,18 +219,18 @@ def extract_from_file(filepath: Path) -> list[dict]:
 
         questions = []
         for item in accordion_items:
-            question = extract_question(str(item), filepath.name)
+            question = extract_question(item, filepath.name)
             if question:
                 questions.append(question)
 
         # Count questions with images
         with_images = sum(1 for q in questions if q.get("images"))
-        print(f"    ✓ Extracted {len(questions)} questions ({with_images} with images)")
+        log.debug(f"  {filepath.name}: {len(questions)} questions ({with_images} with images)")
         
         return questions
 
     except Exception as e:
-        print(f"    ✗ Error: {str(e)}")
+        print(f"  ✗ Error in {filepath.name}: {str(e)}")
         return []
 
 
@@ -230,7 +241,7 @@ def extract_all_mi_eunacom() -> list[dict]:
 
     # Exclude files inside Reconstrucciones folder if it exists
     html_files = sorted([
-        f for f in (list(raw_dir.glob("*.html")) + list(raw_dir.glob("*.htm")))
+        f for f in list_html_files(raw_dir)
         if "Reconstrucciones" not in str(f)
     ])
 
@@ -239,22 +250,20 @@ def extract_all_mi_eunacom() -> list[dict]:
     print(f"{'='*60}")
     print(f"Files found: {len(html_files)}\n")
 
-    all_questions = []
+    # Duplicates are dropped as results arrive (first occurrence of each question_id wins)
+    unique_by_id = {}
+    total_questions = 0
 
-    for html_file in html_files:
-        questions = extract_from_file(html_file)
-        all_questions.extend(questions)
+    # Files are independent and parsing is CPU-bound: one process per core
+    for questions in map_files(extract_from_file, html_files):
+        total_questions += len(questions)
+        for q in questions:
+            unique_by_id.setdefault(q["question_id"], q)
 
-    # Remove duplicates
-    seen_ids = set()
-    unique_questions = []
-    for q in all_questions:
-        qid = q["question_id"]
-        if qid not in seen_ids:
-            seen_ids.add(qid)
-            unique_questions.append(q)
+    unique_questions = list(unique_by_id.values())
+    print(f"Processed {len(html_files)} files, {total_questions} questions")
 
-    duplicates = len(all_questions) - len(unique_questions)
+    duplicates = total_questions - len(unique_questions)
     if duplicates > 0:
         print(f"\n⚠️  Removed {duplicates} duplicates")
 
@@ -270,5 +279,6 @@ def extract_all_mi_eunacom() -> list[dict]:
 if __name__ == "__main__":
     questions = extract_all_mi_eunacom()
     if questions:
-        output_file = save_questions(questions, "mi_eunacom")
+        # Already validated by print_extraction_summary inside the extractor
+        output_file = save_questions(questions, "mi_eunacom", validate=False)
         print(f"\n💾 Saved: {output_file}")
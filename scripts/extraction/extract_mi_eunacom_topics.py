@@ -1,214 +1,46 @@
 """Extract questions from MI_EUNACOM_TOPICS HTML files - WITH MODULE SUBFOLDERS AND TOPIC EXTRACTION"""
 
-from bs4 import BeautifulSoup
-import html as html_module
+from bs4 import BeautifulSoup, Tag
+import logging
 from pathlib import Path
-import re
-from utils import save_questions, print_extraction_summary
+from utils import (
+    save_questions, print_extraction_summary, extract_from_view_source, map_files,
+    list_html_files, list_subfolders, HTML_PARSER, Question,
+)
 from config import get_raw_data_root
+# Answer parsing and the base question fields are identical to MI_EUNACOM
+from extract_mi_eunacom import extract_question as extract_mi_eunacom_question, ACCORDION_STRAINER
 
-
-# ============================================================================
-# Image Extraction
-# ============================================================================
-
-def extract_images_from_element(element) -> list[str]:
-    """
-    Extract all image URLs from an HTML element
-    Returns list of image URLs (can be empty)
-    """
-    if element is None:
-        return []
-
-    images = []
-    for img in element.find_all("img"):
-        src = img.get("src", "")
-        if src:
-            images.append(src)
-
-    return images
-
-
-# ============================================================================
-# HTML Processing
-# ============================================================================
-
-def extract_from_view_source(filepath: Path) -> str:
-    """Extract HTML from view-source saved file"""
-    with open(filepath, "r", encoding="utf-8") as f:
-        content = f.read()
-
-    if "line-content" in content:
-        soup = BeautifulSoup(content, "html.parser")
-        lines = soup.find_all("td", class_="line-content")
-        html_parts = [line.get_text() for line in lines]
-        actual_html = "\n".join(html_parts)
-        return html_module.unescape(actual_html)
-
-    return content
-
-
-# ============================================================================
-# Answer Option Parsing
-# ============================================================================
-
-def parse_answer_options(soup: BeautifulSoup) -> list[dict]:
-    """
-    Extract answer options - handles broken HTML structure
-    """
-    answers = []
-    answer_list = soup.find("ul", class_="global-list")
-
-    if not answer_list:
-        return answers
-
-    for li in answer_list.find_all("li", recursive=False):
-        # Check if correct (green background)
-        is_correct = False
-        span = li.find("span", style=True)
-        if span and "#CFFCE4" in span.get("style", ""):
-            is_correct = True
-
-        # Get the label containing all text
-        label = li.find("span", class_="mdl-radio__label")
-        if not label:
-            continue
-
-        full_text = label.get_text(strip=True)
-
-        # Parse structure: "a) Short answer text (correcta/incorrecta): Detailed explanation"
-        letter_match = re.match(r"^([a-e])\)\s*", full_text)
-        if letter_match:
-            option_letter = letter_match.group(1) + "."
-            text_after_letter = full_text[len(letter_match.group(0)):].strip()
-        else:
-            option_letter = f"{chr(97 + len(answers))}."
-            text_after_letter = full_text
-
-        # Split on (correcta)/(incorrecta) marker followed by ":"
-        pattern = r"^(.*?)\s*\((correcta|incorrecta)\):\s*(.*)$"
-        match = re.match(pattern, text_after_letter, re.DOTALL | re.IGNORECASE)
-
-        if match:
-            short_text = match.group(1).strip()
-            detailed_explanation = match.group(3).strip()
-        else:
-            if ":" in text_after_letter:
-                parts = text_after_letter.split(":", 1)
-                short_text = re.sub(r"\s*\((correcta|incorrecta)\)", "", parts[0], flags=re.IGNORECASE).strip()
-                detailed_explanation = parts[1].strip()
-            else:
-                short_text = re.sub(r"\s*\((correcta|incorrecta)\)", "", text_after_letter, flags=re.IGNORECASE).strip()
-                detailed_explanation = ""
-
-        # Clean up
-        short_text = re.sub(r"\s*\((correcta|incorrecta)\)", "", short_text, flags=re.IGNORECASE).strip()
-
-        # Remove duplicate text patterns
-        duplicate_pattern = r"^(.+?)([a-e]\)|\s+)\s*\1$"
-        duplicate_match = re.match(duplicate_pattern, short_text, re.IGNORECASE)
-        if duplicate_match:
-            short_text = duplicate_match.group(1).strip()
-
-        # Handle direct duplicates like "TextoTexto"
-        if len(short_text) % 2 == 0:
-            midpoint = len(short_text) // 2
-            first_half = short_text[:midpoint]
-            second_half = short_text[midpoint:]
-            if first_half == second_half and len(first_half) > 0:
-                short_text = first_half
-
-        answers.append({
-            "letter": option_letter,
-            "text": short_text,
-            "explanation": detailed_explanation,
-            "is_correct": is_correct,
-        })
-
-    return answers
+# Per-file progress goes to DEBUG (extract_all.py -v); one summary line is printed per source
+log = logging.getLogger(__name__)
 
 
 # ============================================================================
 # Question Extraction
 # ============================================================================
 
-def extract_question(item_html: str, source_filename: str, module_name: str) -> dict | None:
+def extract_question(item: Tag, source_filename: str, module_name: str) -> Question | None:
     """Extract single question from HTML - WITH IMAGE SUPPORT AND TOPIC EXTRACTION"""
-    soup = BeautifulSoup(item_html, "html.parser")
-
-    # Extract question ID
-    question_id = None
-    button = soup.find("button", {"data-bs-target": re.compile("question_")})
-    if button:
-        target = button.get("data-bs-target", "")
-        match = re.search(r"question_(\d+)", target)
-        if match:
-            question_id = match.group(1)
-
-    if not question_id:
+    question = extract_mi_eunacom_question(item, source_filename)
+    if not question:
         return None
 
     # Make question_id unique by prefixing with module name
-    unique_question_id = f"{module_name}_{question_id}"
-
-    # Extract question text
-    question_text = ""
-    if button:
-        bold = button.find("b")
-        if bold:
-            question_text = bold.get_text(strip=True)
+    question["question_id"] = f"{module_name}_{question['question_id']}"
 
     # Extract topic from h6.modal-title
-    topic = ""
-    modal_title = soup.find("h6", class_="modal-title")
-    if modal_title:
-        topic = modal_title.get_text(strip=True)
+    modal_title = item.find("h6", class_="modal-title")
+    question["topic"] = modal_title.get_text(strip=True) if modal_title else ""
 
-    # Extract images from the question area
-    images = extract_images_from_element(soup)
-
-    # Extract general explanation (topic-level, not option-level)
-    explanation = ""
-    modal_body = soup.find("div", class_="modal-body")
-    if modal_body:
-        p_tag = modal_body.find("p")
-        if p_tag:
-            explanation = p_tag.get_text(strip=True).replace("&quot;", "").strip('"')
-
-    # Extract answer options
-    answer_options = parse_answer_options(soup)
-
-    if not answer_options:
-        return None
-
-    # Find correct answer
-    correct_answer = ""
-    for opt in answer_options:
-        if opt["is_correct"]:
-            correct_answer = f"{opt['letter']} {opt['text']}"
-            break
-
-    return {
-        "question_id": unique_question_id,
-        "question_number": question_id,
-        "topic": topic,
-        "question_text": question_text,
-        "answer_options": answer_options,
-        "correct_answer": correct_answer,
-        "explanation": explanation,
-        "images": images,
-        "source_file": source_filename,
-        "source_type": "mi_eunacom_topics",
-    }
+    question["source_type"] = "mi_eunacom_topics"
+    return question
 
 
 def extract_from_file(filepath: Path, module_name: str) -> list[dict]:
     """Extract all questions from one file"""
-    print(f"  Processing: {filepath.name}")
-
     try:
         html = extract_from_view_source(filepath)
-        soup = BeautifulSoup(html, "html.parser")
+        soup = BeautifulSoup(html, HTML_PARSER, parse_only=ACCORDION_STRAINER)
 
         accordion_items = soup.find_all("div", class_="gray-card accordion-item")
         if not accordion_items:
@@ -216,34 +48,24 @@ def extract_from_file(filepath: Path, module_name: str) -> list[dict]:
 
         questions = []
         for item in accordion_items:
-            question = extract_question(str(item), filepath.name, module_name)
+            question = extract_question(item, filepath.name, module_name)
             if question:
                 questions.append(question)
 
         # Count questions with images
         with_images = sum(1 for q in questions if q.get("images"))
-        print(f"    ✓ Extracted {len(questions)} questions ({with_images} with images)")
+        log.debug(f"  {filepath.name}: {len(questions)} questions ({with_images} with images)")
 
         return questions
 
     except Exception as e:
-        print(f"    ✗ Error: {str(e)}")
+        print(f"  ✗ Error in {filepath.name}: {str(e)}")
         return []
 
 
-def extract_from_module_folder(module_folder: Path) -> list[dict]:
-    """Extract all questions from a module folder"""
-    module_name = module_folder.name
-    print(f"\n  Module: {module_name}")
-
-    html_files = sorted(list(module_folder.glob("*.html")) + list(module_folder.glob("*.htm")))
-
-    all_questions = []
-    for html_file in html_files:
-        questions = extract_from_file(html_file, module_name)
-        all_questions.extend(questions)
-
-    return all_questions
+def list_module_files(module_folder: Path) -> list[Path]:
+    """HTML files of a module folder, sorted by name"""
+    return sorted(list_html_files(module_folder))
 
 
 def extract_all_mi_eunacom_topics() -> list[dict]:
@@ -256,28 +78,33 @@ def extract_all_mi_eunacom_topics() -> list[dict]:
     print(f"{'='*60}")
 
     # Find all module subdirectories
-    module_folders = sorted([d for d in raw_dir.iterdir() if d.is_dir()])
+    module_folders = list_subfolders(raw_dir)
     print(f"Modules found: {len(module_folders)}")
+
+    # One flat (file, module) job list across all modules, in module/file order
+    html_files = []
+    module_names = []
     for mf in module_folders:
-        print(f"  - {mf.name}")
+        files = list_module_files(mf)
+        print(f"  - {mf.name} ({len(files)} files)")
+        html_files.extend(files)
+        module_names.extend([mf.name] * len(files))
     print()
 
-    all_questions = []
+    # Duplicates are dropped as results arrive (first occurrence of each question_id wins)
+    unique_by_id = {}
+    total_questions = 0
 
-    for module_folder in module_folders:
-        questions = extract_from_module_folder(module_folder)
-        all_questions.extend(questions)
+    # Workers read and parse their own files, so disk I/O overlaps parsing
+    for questions in map_files(extract_from_file, html_files, module_names):
+        total_questions += len(questions)
+        for q in questions:
+            unique_by_id.setdefault(q["question_id"], q)
 
-    # Remove duplicates
-    seen_ids = set()
-    unique_questions = []
-    for q in all_questions:
-        qid = q["question_id"]
-        if qid not in seen_ids:
-            seen_ids.add(qid)
-            unique_questions.append(q)
+    unique_questions = list(unique_by_id.values())
+    print(f"Processed {len(html_files)} files, {total_questions} questions")
 
-    duplicates = len(all_questions) - len(unique_questions)
+    duplicates = total_questions - len(unique_questions)
     if duplicates > 0:
         print(f"\n⚠️  Removed {duplicates} duplicates")
 
@@ -293,5 +120,6 @@ def extract_all_mi_eunacom_topics() -> list[dict]:
 if __name__ == "__main__":
     questions = extract_all_mi_eunacom_topics()
     if questions:
-        output_file = save_questions(questions, "mi_eunacom_topics")
+        # Already validated by print_extraction_summary inside the extractor
+        output_file = save_questions(questions, "mi_eunacom_topics", validate=False)
         print(f"\n💾 Saved: {output_file}")
@@ -1,26 +1,49 @@
 """
 Extract questions from Reconstrucciones folders.
-Reuses Guevara and MI_EUNACOM extraction logic.
+Reuses Guevara (lxml) and MI_EUNACOM (BeautifulSoup) extraction logic.
 Adds reconstruction_name and reconstruction_order fields for ordered practice.
 """
 
+from collections import Counter
+from contextlib import redirect_stdout
+import io
+from itertools import chain
+from lxml import etree
 from pathlib import Path
 import re
+import sys
 from bs4 import BeautifulSoup
 
 from config import get_raw_data_root
-from utils import save_questions, print_extraction_summary
-from extract_guevara import extract_images_from_element
-from extract_mi_eunacom import extract_question as extract_mi_eunacom_question
+from utils import (
+    save_questions, print_extraction_summary, extract_from_view_source, is_view_source, map_files,
+    list_html_files, list_subfolders, HTML_PARSER, Question,
+)
+from extract_guevara import (
+    iter_question_elements, page_source, first, join_text,
+    X_QNO, X_QTEXT, X_ANSWERS, X_LABEL, X_LETTER, X_OPTION_TEXT, X_FEEDBACK, X_IMG_SRC,
+    X_TEXT, X_TEXT_OUTSIDE_TABLES, X_TABLE_DEPTH, has_class,
+)
+from extract_mi_eunacom import extract_question as extract_mi_eunacom_question, ACCORDION_STRAINER
+
+# Guevara questions share extract_guevara's compiled XPath queries; this one is reconstruction-only
+X_RIGHT_ANSWER = etree.XPath(f".//div[{has_class('rightanswer')}]")
+
+# rightanswer div text: "La respuesta correcta es: {answer text}"
+RIGHT_ANSWER_MARKER = "La respuesta correcta es:"
+# reconstruction_name -> question_id fragment ("Agosto 2021" -> "agosto_2021")
+SAFE_NAME_RE = re.compile(r"[^a-zA-Z0-9_]")
+# Leading ":" / whitespace left after slicing "...correcta" off a rightanswer div
+LEADING_COLON_RE = re.compile(r"^[:\s]+")
 
 
 # ============================================================================
 # Reconstruction Extraction - Guevara Format
 # ============================================================================
 
-def extract_question_reconstruction(question_div, source_filename: str) -> dict | None:
+def extract_question_reconstruction(question_div, source_filename: str) -> Question | None:
     """
-    Extract single question from Reconstrucción HTML.
+    Extract single question from a Reconstrucción lxml element.
     
     KEY DIFFERENCE from regular Guevara:
     - Correct answer is NOT marked in option classes
@@ -33,37 +56,33 @@ def extract_question_reconstruction(question_div, source_filename: str) -> dict
             return None
 
         # Question number (remove "Pregunta" prefix)
-        qno_span = question_div.find("span", class_="qno")
-        q_number = qno_span.get_text(strip=True).replace("Pregunta ", "") if qno_span else ""
+        qno_span = first(X_QNO(question_div))
+        q_number = join_text(X_TEXT(qno_span)).replace("Pregunta ", "") if qno_span is not None else ""
 
         # Question text div
-        qtext_div = question_div.find("div", class_="qtext")
-        
-        # Extract images
-        images = extract_images_from_element(qtext_div)
-        
-        # Extract text
-        if qtext_div:
-            qtext_copy = qtext_div.__copy__()
-            for table in qtext_copy.find_all("table"):
-                table.decompose()
-            q_text = qtext_copy.get_text(strip=True, separator=" ")
+        qtext_div = first(X_QTEXT(question_div))
+
+        if qtext_div is not None:
+            # Images come from the whole qtext, tables included
+            images = [src for src in X_IMG_SRC(qtext_div) if src]
+            # Text skips nested tables
+            depth = int(X_TABLE_DEPTH(qtext_div))
+            q_text = join_text(X_TEXT_OUTSIDE_TABLES(qtext_div, depth=depth), " ")
         else:
+            images = []
             q_text = ""
 
         # Answer options - extract ALL first (none marked correct yet)
-        answer_divs = question_div.find_all("div", class_=re.compile(r"^r[0-1]$"))
-
         all_options = []
-        for ans_div in answer_divs:
-            label = ans_div.find("div", class_="d-flex")
-            if label:
-                letter_span = label.find("span", class_="answernumber")
-                text_div = label.find("div", class_="flex-fill")
+        for ans_div in X_ANSWERS(question_div):
+            label = first(X_LABEL(ans_div))
+            if label is not None:
+                letter_span = first(X_LETTER(label))
+                text_div = first(X_OPTION_TEXT(label))
 
-                if letter_span and text_div:
-                    letter = letter_span.get_text(strip=True)
-                    text = text_div.get_text(strip=True)
+                if letter_span is not None and text_div is not None:
+                    letter = join_text(X_TEXT(letter_span))
+                    text = join_text(X_TEXT(text_div))
 
                     all_options.append({
                         "letter": letter,
@@ -74,30 +93,30 @@ def extract_question_reconstruction(question_div, source_filename: str) -> dict
 
         # CRITICAL: Find correct answer from rightanswer div
         correct_answer_text = ""
-        rightanswer_div = question_div.find("div", class_="rightanswer")
+        rightanswer_div = first(X_RIGHT_ANSWER(question_div))
         
-        if rightanswer_div:
-            rightanswer_full = rightanswer_div.get_text(strip=True)
-            # Pattern: "La respuesta correcta es: {answer text}"
-            if "La respuesta correcta es:" in rightanswer_full:
-                correct_answer_text = rightanswer_full.split("La respuesta correcta es:")[-1].strip()
-            elif "respuesta correcta" in rightanswer_full.lower():
-                # Fallback: try to extract after any "correcta" mention
-                parts = rightanswer_full.lower().split("correcta")
-                if len(parts) > 1:
-                    correct_answer_text = rightanswer_full[rightanswer_full.lower().rfind("correcta") + len("correcta"):].strip()
+        if rightanswer_div is not None:
+            rightanswer_full = join_text(X_TEXT(rightanswer_div))
+            # Pattern: "La respuesta correcta es: {answer text}" (text after the last marker)
+            marker_end = rightanswer_full.rfind(RIGHT_ANSWER_MARKER)
+            if marker_end != -1:
+                correct_answer_text = rightanswer_full[marker_end + len(RIGHT_ANSWER_MARKER):].strip()
+            else:
+                rightanswer_lower = rightanswer_full.lower()
+                if "respuesta correcta" in rightanswer_lower:
+                    # Fallback: take what follows the last "correcta" mention
+                    cut = rightanswer_lower.rfind("correcta") + len("correcta")
                     # Remove leading ":"  or "es:" if present
-                    correct_answer_text = re.sub(r"^[:\s]+", "", correct_answer_text).strip()
+                    correct_answer_text = LEADING_COLON_RE.sub("", rightanswer_full[cut:].strip()).strip()
 
         # Match correct answer to options
         correct_answer = ""
         if correct_answer_text and all_options:
             # Normalize for comparison
             correct_normalized = correct_answer_text.lower().strip()
+            normalized_options = [(opt, opt["text"].lower().strip()) for opt in all_options]
             
-            for opt in all_options:
-                opt_text_normalized = opt["text"].lower().strip()
-                
+            for opt, opt_text_normalized in normalized_options:
                 # Check if option text matches (exact or contained)
                 if opt_text_normalized == correct_normalized:
                     opt["is_correct"] = True
@@ -111,8 +130,8 @@ def extract_question_reconstruction(question_div, source_filename: str) -> dict
             # If no match found, try fuzzy match (first few words)
             if not correct_answer:
                 correct_words = correct_normalized.split()[:3]  # First 3 words
-                for opt in all_options:
-                    opt_words = opt["text"].lower().split()[:3]
+                for opt, opt_text_normalized in normalized_options:
+                    opt_words = opt_text_normalized.split()[:3]
                     if correct_words == opt_words:
                         opt["is_correct"] = True
                         correct_answer = f"{opt['letter']} {opt['text']}"
@@ -123,8 +142,8 @@ def extract_question_reconstruction(question_div, source_filename: str) -> dict
             print(f"      ⚠️ Could not match correct answer: '{correct_answer_text[:50]}...'")
 
         # General explanation (topic-level)
-        feedback_div = question_div.find("div", class_="generalfeedback")
-        explanation = feedback_div.get_text(strip=True, separator=" ") if feedback_div else ""
+        feedback_div = first(X_FEEDBACK(question_div))
+        explanation = join_text(X_TEXT(feedback_div), " ") if feedback_div is not None else ""
 
         return {
             "question_id": question_id,
@@ -150,35 +169,31 @@ def extract_guevara_reconstruction(filepath: Path, reconstruction_name: str, ord
     Returns questions with reconstruction metadata.
     """
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            html_content = f.read()
+        if filepath.stat().st_size == 0:
+            return []
 
-        # Handle view-source format
-        soup_viewsource = BeautifulSoup(html_content, "html.parser")
-        line_contents = soup_viewsource.find_all("td", class_="line-content")
+        # Find questions: divs with a question-N-M id, else (no such div at all) by class.
+        # Each list keeps (position among its matching divs, question) for reconstruction_order
+        found_by_id = False
+        by_id = []
+        by_class = []
 
-        if line_contents:
-            actual_html_lines = [line_td.get_text() for line_td in line_contents]
-            actual_html = "\n".join(actual_html_lines)
-            soup = BeautifulSoup(actual_html, "html.parser")
-        else:
-            soup = soup_viewsource
+        for question_div, matches_id, matches_class in iter_question_elements(page_source(filepath)):
+            found_by_id = found_by_id or matches_id
+            # Use reconstruction-specific extractor (handles rightanswer div)
+            question = extract_question_reconstruction(question_div, filepath.name)
+            if matches_id:
+                by_id.append((len(by_id), question))
+            if matches_class:
+                by_class.append((len(by_class), question))
 
-        # Find questions
-        questions_divs = soup.find_all("div", id=re.compile(r"question-\d+-\d+"))
-        if not questions_divs:
-            questions_divs = soup.find_all("div", class_=re.compile(r"que.*multichoice"))
+        # Generate unique IDs for reconstruction (prefix is the same for the whole file)
+        id_prefix = "recon_guevara_" + SAFE_NAME_RE.sub("_", reconstruction_name.lower()) + "_"
 
         questions = []
-        for idx, question_div in enumerate(questions_divs):
-            # Use reconstruction-specific extractor (handles rightanswer div)
-            question = extract_question_reconstruction(question_div, filepath.name)
-            
+        for idx, question in (by_id if found_by_id else by_class):
             if question:
-                # Generate unique ID for reconstruction
-                safe_name = re.sub(r'[^a-zA-Z0-9_]', '_', reconstruction_name.lower())
-                original_id = question["question_id"]
-                question["question_id"] = f"recon_guevara_{safe_name}_{original_id}"
+                question["question_id"] = id_prefix + question["question_id"]
                 
                 # Add reconstruction metadata
                 question["reconstruction_name"] = reconstruction_name
@@ -202,24 +217,27 @@ def extract_mi_eunacom_reconstruction(filepath: Path, reconstruction_name: str,
     Extract questions from a MI_EUNACOM-format reconstruction HTML file.
     Returns questions with reconstruction metadata.
     """
-    from extract_mi_eunacom import extract_from_view_source
-    
     try:
-        html = extract_from_view_source(filepath)
-        soup = BeautifulSoup(html, "html.parser")
+        if is_view_source(filepath):
+            soup = BeautifulSoup(extract_from_view_source(filepath), HTML_PARSER, parse_only=ACCORDION_STRAINER)
+        else:
+            # Plain pages go in as bytes with a known encoding: no str copy, no charset sniffing
+            soup = BeautifulSoup(
+                filepath.read_bytes(), HTML_PARSER, parse_only=ACCORDION_STRAINER, from_encoding="utf-8"
+            )
 
         accordion_items = soup.find_all("div", class_="gray-card accordion-item")
         if not accordion_items:
             accordion_items = soup.find_all("div", class_="accordion-item")
 
+        # Generate unique IDs for reconstruction (prefix is the same for the whole file)
+        id_prefix = "recon_mieunacom_" + SAFE_NAME_RE.sub("_", reconstruction_name.lower()) + "_"
+
         questions = []
         for idx, item in enumerate(accordion_items):
-            question = extract_mi_eunacom_question(str(item), filepath.name)
+            question = extract_mi_eunacom_question(item, filepath.name)
             if question:
-                # Generate unique ID for reconstruction
-                safe_name = re.sub(r'[^a-zA-Z0-9_]', '_', reconstruction_name.lower())
-                original_id = question["question_id"]
-                question["question_id"] = f"recon_mieunacom_{safe_name}_{original_id}"
+                question["question_id"] = id_prefix + question["question_id"]
                 
                 # Add reconstruction metadata
                 question["reconstruction_name"] = reconstruction_name
@@ -239,17 +257,30 @@ def extract_mi_eunacom_reconstruction(filepath: Path, reconstruction_name: str,
 # Process Single Reconstruction Folder
 # ============================================================================
 
+def extract_reconstruction_file(html_file: Path, extractor, reconstruction_name: str) -> tuple[list[dict], str]:
+    """
+    Worker: one file with order_offset=0 (the folder-wide offset is added by the caller).
+    Its warnings are captured and returned with the questions, so the caller prints them
+    in file order even when files run in other processes.
+    """
+    output = io.StringIO()
+    with redirect_stdout(output):
+        questions = extractor(html_file, reconstruction_name, 0)
+    return questions, output.getvalue()
+
+
 def extract_reconstruction_folder(folder: Path, source_type: str) -> list[dict]:
     """
     Extract all questions from a reconstruction folder (e.g., "Agosto 2021").
     Maintains order across multiple HTML files.
     """
-    reconstruction_name = folder.name
+    # Interned: every question of the folder points at this one string
+    reconstruction_name = sys.intern(folder.name)
     print(f"\n  📁 Reconstruction: {reconstruction_name}")
 
     # Get HTML files sorted by name (01.html, 02.html, etc.)
     html_files = sorted(
-        list(folder.glob("*.html")) + list(folder.glob("*.htm")),
+        list_html_files(folder),
         key=lambda p: p.stem  # Sort by filename without extension
     )
 
@@ -259,25 +290,45 @@ def extract_reconstruction_folder(folder: Path, source_type: str) -> list[dict]:
 
     print(f"    Files: {len(html_files)}")
 
-    all_questions = []
+    per_file = []
     order_offset = 0
+    with_images = 0
+    with_correct = 0
 
-    for html_file in html_files:
-        print(f"    Processing: {html_file.name}", end=" ")
+    # Extractor is picked once per folder
+    extractor = extract_guevara_reconstruction if source_type == "guevara" else extract_mi_eunacom_reconstruction
 
-        if source_type == "guevara":
-            questions = extract_guevara_reconstruction(html_file, reconstruction_name, order_offset)
-        else:
-            questions = extract_mi_eunacom_reconstruction(html_file, reconstruction_name, order_offset)
-
-        print(f"→ {len(questions)} questions")
-        
-        all_questions.extend(questions)
+    # Files are parsed in parallel; results come back in file order so numbering stays stable
+    results = map_files(
+        extract_reconstruction_file, html_files,
+        [extractor] * len(html_files), [reconstruction_name] * len(html_files),
+    )
+    for html_file, (questions, warnings) in zip(html_files, results):
+        # The file's own warnings first, then its summary line
+        if warnings:
+            print(warnings, end="")
+
+        for q in questions:
+            q["reconstruction_order"] += order_offset
+            # Worker results come back unpickled with their own copies of the repeated strings
+            q["reconstruction_name"] = reconstruction_name
+            q["source_type"] = sys.intern(q["source_type"])
+            # Stats: correct_answer is only filled in when an option was marked correct
+            if q.get("images"):
+                with_images += 1
+            if q.get("correct_answer"):
+                with_correct += 1
+
+        # One line per file, written once the file is done
+        print(f"    Processing: {html_file.name} → {len(questions)} questions")
+
+        per_file.append(questions)
         order_offset += len(questions)
 
+    # Flattened once, at its final size
+    all_questions = list(chain.from_iterable(per_file))
+
     # Stats
-    with_images = sum(1 for q in all_questions if q.get("images"))
-    with_correct = sum(1 for q in all_questions if any(opt.get("is_correct") for opt in q.get("answer_options", [])))
     without_correct = len(all_questions) - with_correct
     
     print(f"    ✓ Total: {len(all_questions)} questions ({with_images} with images)")
@@ -302,7 +353,7 @@ def extract_guevara_reconstrucciones() -> list[dict]:
         return []
 
     # Find reconstruction folders
-    recon_folders = sorted([d for d in recon_dir.iterdir() if d.is_dir()])
+    recon_folders = list_subfolders(recon_dir)
 
     if not recon_folders:
         print(f"  ℹ️ No reconstruction folders found in {recon_dir}")
@@ -312,12 +363,7 @@ def extract_guevara_reconstrucciones() -> list[dict]:
     for folder in recon_folders:
         print(f"    - {folder.name}")
 
-    all_questions = []
-    for folder in recon_folders:
-        questions = extract_reconstruction_folder(folder, "guevara")
-        all_questions.extend(questions)
-
-    return all_questions
+    return list(chain.from_iterable(extract_reconstruction_folder(folder, "guevara") for folder in recon_folders))
 
 
 def extract_mi_eunacom_reconstrucciones() -> list[dict]:
@@ -330,7 +376,7 @@ def extract_mi_eunacom_reconstrucciones() -> list[dict]:
         return []
 
     # Find reconstruction folders
-    recon_folders = sorted([d for d in recon_dir.iterdir() if d.is_dir()])
+    recon_folders = list_subfolders(recon_dir)
 
     if not recon_folders:
         print(f"  ℹ️ No reconstruction folders found in {recon_dir}")
@@ -340,12 +386,7 @@ def extract_mi_eunacom_reconstrucciones() -> list[dict]:
     for folder in recon_folders:
         print(f"    - {folder.name}")
 
-    all_questions = []
-    for folder in recon_folders:
-        questions = extract_reconstruction_folder(folder, "mi_eunacom")
-        all_questions.extend(questions)
-
-    return all_questions
+    return list(chain.from_iterable(extract_reconstruction_folder(folder, "mi_eunacom") for folder in recon_folders))
 
 
 def extract_all_reconstrucciones() -> list[dict]:
@@ -361,23 +402,19 @@ def extract_all_reconstrucciones() -> list[dict]:
     print("\n📚 MI_EUNACOM Reconstrucciones:")
     mi_eunacom_questions = extract_mi_eunacom_reconstrucciones()
 
-    # Merge
-    all_questions = guevara_questions + mi_eunacom_questions
+    total_questions = len(guevara_questions) + len(mi_eunacom_questions)
 
-    if not all_questions:
+    if not total_questions:
         print("\n⚠️ No reconstruction questions found")
         return []
 
-    # Remove duplicates (shouldn't happen but safety check)
-    seen_ids = set()
-    unique_questions = []
-    for q in all_questions:
-        qid = q["question_id"]
-        if qid not in seen_ids:
-            seen_ids.add(qid)
-            unique_questions.append(q)
+    # Merge and remove duplicates in one pass (shouldn't happen but safety check; first occurrence wins)
+    unique_by_id = {}
+    for q in chain(guevara_questions, mi_eunacom_questions):
+        unique_by_id.setdefault(q["question_id"], q)
+    unique_questions = list(unique_by_id.values())
 
-    duplicates = len(all_questions) - len(unique_questions)
+    duplicates = total_questions - len(unique_questions)
     if duplicates > 0:
         print(f"\n⚠️ Removed {duplicates} duplicates")
 
@@ -386,13 +423,9 @@ def extract_all_reconstrucciones() -> list[dict]:
     print("📊 RECONSTRUCTION SUMMARY")
     print(f"{'='*60}")
 
-    recon_counts = {}
-    for q in unique_questions:
-        name = q.get("reconstruction_name", "Unknown")
-        recon_counts[name] = recon_counts.get(name, 0) + 1
+    recon_counts = Counter(q.get("reconstruction_name", "Unknown") for q in unique_questions)
 
-    for name, count in sorted(recon_counts.items()):
-        print(f"  {name}: {count} questions")
+    print("\n".join(f"  {name}: {count} questions" for name, count in sorted(recon_counts.items())))
 
     print(f"\n  Total: {len(unique_questions)} questions")
 
@@ -1,10 +1,203 @@
 """Shared utilities for all extractors - WITH IMAGE SUPPORT AND ASSERTIONS"""
 
 from pathlib import Path
+import html as html_module
 import json
+import mmap
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from typing import TypedDict
+from lxml import etree
 from config import get_processed_data_root
 
+HTML_PARSER = "lxml"  # BeautifulSoup backend: C-backed, much faster than html.parser
+
+# View-source pages: one <td class="line-content"> per source line, its markup only syntax-highlight spans
+LINE_CONTENT_RE = re.compile(rb'<td[^>]*class="line-content"[^>]*>(.*?)</td>', re.DOTALL)
+TAG_RE = re.compile(rb"<[^>]*>")
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # Fall back to stdlib json
+
+# Parses single JSON documents (e.g. .jsonl log lines) with orjson when available;
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers catch one type
+json_loads = orjson.loads if orjson is not None else json.loads
+
+
+# ============================================================================
+# JSON I/O (orjson when available)
+# ============================================================================
+
+def write_json(path: Path, data):
+    """Write JSON with 2-space indent and raw UTF-8 (same layout either way), in one write"""
+    path.write_bytes(dump_json_bytes(data))
+
+
+def dump_json_bytes(data) -> bytes:
+    """Serialize one value with 2-space indent as UTF-8 bytes"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def write_json_records(path: Path, records: list):
+    """
+    Write a JSON array one record at a time: same bytes as write_json,
+    but only one serialized record is held in memory at once.
+    """
+    if not records:
+        path.write_bytes(b"[]")
+        return
+
+    with open(path, "wb") as f:
+        f.write(b"[\n")
+        for i, record in enumerate(records):
+            if i:
+                f.write(b",\n")
+            # Nest the record one level (strings never hold raw newlines in JSON)
+            f.write(b"  " + dump_json_bytes(record).replace(b"\n", b"\n  "))
+        f.write(b"\n]")
+
+
+def read_json(path: Path):
+    """Load a JSON file (orjson parses the memory-mapped file, no bytes copy of it is made)"""
+    if orjson is not None:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return orjson.loads(f.read())  # Empty file: the usual JSONDecodeError
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                return orjson.loads(view)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_mappings_with_log(json_path: Path) -> dict[str, str]:
+    """
+    Load image mappings (original_url -> supabase_url): the JSON snapshot at
+    json_path overlaid with its .jsonl append log, which an interrupted
+    migration run leaves behind before compacting.
+    """
+    mappings = {}
+    if json_path.exists():
+        mappings = read_json(json_path)
+
+    log_path = json_path.with_suffix(".jsonl")
+    if log_path.exists():
+        with open(log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    mappings.update(json_loads(line))
+                except json.JSONDecodeError:
+                    # Partial last line from an interrupted run
+                    print(f"⚠️  Skipping corrupt line in {log_path.name}")
+
+    return mappings
+
+
+# ============================================================================
+# HTML Processing
+# ============================================================================
+
+def is_view_source(filepath: Path) -> bool:
+    """True for a saved view-source page (checked on the memory-mapped bytes, nothing is read into Python)"""
+    with open(filepath, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return False
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm.find(b"line-content") != -1
+
+
+def extract_from_view_source(filepath: Path) -> str:
+    """
+    Extract HTML from view-source saved file (plain HTML files are returned as-is).
+    The file is memory-mapped and the line-content cells are cut out with a regex, no DOM is built.
+    """
+    with open(filepath, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm.find(b"line-content") == -1:
+                return mm[:].decode("utf-8")
+            lines = [TAG_RE.sub(b"", line) for line in LINE_CONTENT_RE.findall(mm)]
+
+    if not lines:
+        # Cells written some other way (single quotes, unclosed <td>): let lxml find them
+        return read_view_source_lines(filepath)
+
+    return html_module.unescape(b"\n".join(lines).decode("utf-8"))
+
+
+def read_view_source_lines(filepath: Path) -> str:
+    """
+    Rejoin the <td class="line-content"> cells of a view-source page.
+    Streams cells with iterparse and drops each after reading, so no full tree is kept.
+    """
+    lines = []
+    for _, td in etree.iterparse(
+        str(filepath), events=("end",), tag="td", html=True, encoding="utf-8", huge_tree=True
+    ):
+        if "line-content" in (td.get("class") or "").split():
+            lines.append("".join(td.itertext()))
+        td.clear(keep_tail=True)
+        while td.getprevious() is not None:
+            del td.getparent()[0]
+
+    return "\n".join(lines)
+
+
+# ============================================================================
+# File Listing
+# ============================================================================
+
+HTML_SUFFIXES = (".html", ".htm")
+
+
+def list_html_files(folder: Path) -> list[Path]:
+    """
+    *.html / *.htm files directly inside folder (unsorted), from a single os.scandir pass.
+    The suffix match ignores case (.HTML too, as Path.glob does on Windows).
+    A missing folder gives [] like Path.glob does.
+    """
+    try:
+        with os.scandir(folder) as entries:
+            return [Path(e.path) for e in entries if e.name.lower().endswith(HTML_SUFFIXES) and e.is_file()]
+    except FileNotFoundError:
+        return []
+
+
+def list_subfolders(folder: Path) -> list[Path]:
+    """Sorted subdirectories of folder (is_dir() is answered from the scandir entry, no extra stat)"""
+    with os.scandir(folder) as entries:
+        return sorted(Path(e.path) for e in entries if e.is_dir())
+
+
+# ============================================================================
+# Per-file Parallelism
+# ============================================================================
+
+PARALLEL_MIN_FILES = 4  # Below this, starting the worker processes costs more than it saves
+
+
+def map_files(func, files: list[Path], *args):
+    """
+    map(func, files, *args) across a process pool (one worker per core), results in file order.
+    Small batches run inline. func must be a module-level function so workers can pickle it.
+    """
+    if len(files) < PARALLEL_MIN_FILES:
+        yield from map(func, files, *args)
+        return
+
+    with ProcessPoolExecutor() as executor:
+        yield from executor.map(func, files, *args, chunksize=4)
+
 
 # ============================================================================
 # Schema Definition
@@ -34,10 +227,53 @@ ANSWER_OPTION_SCHEMA = {
 }
 
 
+class AnswerOption(TypedDict):
+    """Static type of one answer option (see ANSWER_OPTION_SCHEMA)"""
+    letter: str
+    text: str
+    explanation: str
+    is_correct: bool
+
+
+class _QuestionFields(TypedDict):
+    question_id: str
+    question_number: str
+    topic: str
+    question_text: str
+    answer_options: list[AnswerOption]
+    correct_answer: str | None
+    explanation: str
+    images: list[str]
+    source_file: str
+    source_type: str
+
+
+class Question(_QuestionFields, total=False):
+    """
+    Static type of an extracted question (see QUESTION_SCHEMA).
+    Records stay plain dicts: they are JSON-serialized, read with .get()
+    and extended in place (reconstruction fields, topics).
+    """
+    reconstruction_name: str | None
+    reconstruction_order: int | None
+
+
 # ============================================================================
 # Validation with Assertions
 # ============================================================================
 
+# Required fields (excluding optional reconstruction fields), in issue-report order
+REQUIRED_FIELDS = (
+    "question_id", "question_number", "topic", "question_text",
+    "answer_options", "correct_answer", "explanation", "images",
+    "source_file", "source_type",
+)
+ANSWER_OPTION_REQUIRED = ("letter", "text", "is_correct")
+
+# Set forms: a valid question/option passes with one subset test
+REQUIRED_FIELDS_SET = frozenset(REQUIRED_FIELDS)
+ANSWER_OPTION_REQUIRED_SET = frozenset(ANSWER_OPTION_REQUIRED)
+
 def validate_question_strict(q: dict, raise_on_error: bool = True) -> list[str]:
     """
     Validate single question structure with strict assertions.
@@ -52,16 +288,11 @@ def validate_question_strict(q: dict, raise_on_error: bool = True) -> list[str]:
     issues = []
     q_id = q.get("question_id", "UNKNOWN")
     
-    # Required fields (excluding optional reconstruction fields)
-    required_fields = [
-        "question_id", "question_number", "topic", "question_text",
-        "answer_options", "correct_answer", "explanation", "images",
-        "source_file", "source_type"
-    ]
-    
-    for field in required_fields:
-        if field not in q:
-            issues.append(f"[{q_id}] Missing required field: {field}")
+    # Required fields: walked in order only when something is missing
+    if not REQUIRED_FIELDS_SET <= q.keys():
+        for field in REQUIRED_FIELDS:
+            if field not in q:
+                issues.append(f"[{q_id}] Missing required field: {field}")
     
     # question_id must not be empty
     if not q.get("question_id", "").strip():
@@ -84,9 +315,10 @@ def validate_question_strict(q: dict, raise_on_error: bool = True) -> list[str]:
                 issues.append(f"[{q_id}] answer_options[{i}] is not a dict")
                 continue
             
-            for field in ["letter", "text", "is_correct"]:
-                if field not in opt:
-                    issues.append(f"[{q_id}] answer_options[{i}] missing '{field}'")
+            if not ANSWER_OPTION_REQUIRED_SET <= opt.keys():
+                for field in ANSWER_OPTION_REQUIRED:
+                    if field not in opt:
+                        issues.append(f"[{q_id}] answer_options[{i}] missing '{field}'")
         
         # Must have exactly one correct answer
         correct_count = sum(1 for opt in opts if opt.get("is_correct", False))
@@ -147,6 +379,11 @@ def assert_no_duplicate_ids(questions: list[dict], source_name: str = ""):
         else:
             seen_ids[q_id] = q.get("source_file", "unknown")
     
+    raise_duplicate_ids(duplicates, source_name)
+
+
+def raise_duplicate_ids(duplicates: list[dict], source_name: str = ""):
+    """Raise AssertionError listing duplicates ({"id", "first_source", "duplicate_source"} dicts), if any"""
     if duplicates:
         error_msg = f"DUPLICATE IDS FOUND in {source_name or 'questions'}:\n"
         for dup in duplicates[:10]:  # Show first 10
@@ -178,6 +415,72 @@ def assert_questions_valid(questions: list[dict], source_name: str = ""):
         raise AssertionError(error_msg)
 
 
+# ============================================================================
+# Single-pass Statistics
+# ============================================================================
+
+class QuestionStats(TypedDict):
+    """Aggregates over a question list, gathered in one pass by summarize_questions"""
+    duplicates: list[dict]  # Same entries as assert_no_duplicate_ids collects
+    unique_ids: int
+    total_issues: int
+    issues_by_type: Counter[str]
+    with_images: int
+    total_images: int
+    recon_counts: Counter[str]
+    source_files: Counter[str]
+
+
+def summarize_questions(questions: list[dict]) -> QuestionStats:
+    """
+    Duplicate IDs, validation issues, image and per-source counts in a single loop,
+    so save_questions and print_extraction_summary walk the questions once each.
+    """
+    seen_ids = {}
+    duplicates = []
+    total_issues = 0
+    issues_by_type = Counter()
+    with_images = 0
+    total_images = 0
+    recon_counts = Counter()
+    source_files = Counter()
+
+    for q in questions:
+        q_id = q.get("question_id", "")
+        src = q.get("source_file", "unknown")
+        if q_id in seen_ids:
+            duplicates.append({"id": q_id, "first_source": seen_ids[q_id], "duplicate_source": src})
+        else:
+            seen_ids[q_id] = src
+
+        issues = validate_question_strict(q, raise_on_error=False)
+        total_issues += len(issues)
+        # Issue type is the part after the "[id]" prefix
+        issues_by_type.update(issue.split("]")[1].strip() if "]" in issue else issue for issue in issues)
+
+        images = q.get("images")
+        if images:
+            with_images += 1
+            total_images += len(images)
+
+        recon_name = q.get("reconstruction_name")
+        if recon_name:
+            recon_counts[recon_name] += 1
+
+        source_files[src] += 1
+
+    return {
+        "duplicates": duplicates,
+        "unique_ids": len(seen_ids),
+        "total_issues": total_issues,
+        "issues_by_type": issues_by_type,
+        "with_images": with_images,
+        "total_images": total_images,
+        "recon_counts": recon_counts,
+        "source_files": source_files,
+    }
+
+
 # ============================================================================
 # Ensure Reconstruction Fields
 # ============================================================================
@@ -205,7 +508,8 @@ def save_questions(questions: list[dict], output_name: str, validate: bool = Tru
     Args:
         questions: List of question dicts
         output_name: Output filename (without extension)
-        validate: If True, validates before saving (default: True)
+        validate: If True, validates before saving (default: True). Pass False when the list
+            already went through print_extraction_summary; duplicate IDs are checked either way.
     """
     # Pre-save assertions
     assert isinstance(questions, list), "questions must be a list"
@@ -217,31 +521,28 @@ def save_questions(questions: list[dict], output_name: str, validate: bool = Tru
     
     if validate:
         print(f"🔍 Validating {len(questions)} questions...")
-        assert_no_duplicate_ids(questions, output_name)
+        stats = summarize_questions(questions)
+        raise_duplicate_ids(stats["duplicates"], output_name)
         # Note: not using assert_questions_valid here to allow partial data
         # but we log issues
-        total_issues = 0
-        for q in questions:
-            issues = validate_question_strict(q, raise_on_error=False)
-            total_issues += len(issues)
+        total_issues = stats["total_issues"]
         
         if total_issues > 0:
             print(f"⚠️  WARNING: {total_issues} validation issues found (saving anyway)")
-    
+    else:
+        assert_no_duplicate_ids(questions, output_name)
+
     processed_dir = get_processed_data_root()
     output_file = processed_dir / f"{output_name}.json"
 
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(questions, f, ensure_ascii=False, indent=2)
+    # Write next to the target and rename over it: a crash mid-write never leaves a truncated file
+    temp_file = output_file.with_suffix(".json.tmp")
+    write_json(temp_file, questions)
+    os.replace(temp_file, output_file)
     
-    # Post-save verification
+    # Post-save verification (a stat, not a full re-read: the bytes came straight from the serializer)
     assert output_file.exists(), f"Failed to create output file: {output_file}"
-    
-    with open(output_file, "r", encoding="utf-8") as f:
-        saved_data = json.load(f)
-    
-    assert len(saved_data) == len(questions), \
-        f"Data mismatch: saved {len(saved_data)}, expected {len(questions)}"
+    assert output_file.stat().st_size > 0, f"Output file is empty: {output_file}"
 
     return output_file
 
@@ -257,51 +558,36 @@ def print_extraction_summary(questions: list[dict], source_name: str):
     print(f"{'='*60}")
     print(f"Total questions: {len(questions)}")
 
+    stats = summarize_questions(questions)
+
     # Check for duplicates
-    ids = [q.get("question_id", "") for q in questions]
-    unique_ids = set(ids)
-    if len(ids) != len(unique_ids):
-        print(f"❌ DUPLICATE IDS: {len(ids) - len(unique_ids)} duplicates found!")
+    if stats["duplicates"]:
+        print(f"❌ DUPLICATE IDS: {len(stats['duplicates'])} duplicates found!")
     else:
-        print(f"✅ All {len(unique_ids)} IDs are unique")
-
-    # Validate all
-    issues_by_type = {}
-    for q in questions:
-        issues = validate_question_strict(q, raise_on_error=False)
-        for issue in issues:
-            # Extract issue type (first part after ID)
-            issue_type = issue.split("]")[1].strip() if "]" in issue else issue
-            issues_by_type[issue_type] = issues_by_type.get(issue_type, 0) + 1
+        print(f"✅ All {stats['unique_ids']} IDs are unique")
 
+    # Validation report
+    issues_by_type = stats["issues_by_type"]
     if not issues_by_type:
         print("✅ All questions validated successfully!")
     else:
         print(f"⚠️  Validation issues found:")
-        for issue_type, count in sorted(issues_by_type.items(), key=lambda x: -x[1]):
-            print(f"   - {issue_type}: {count}")
+        print("\n".join(
+            f"   - {issue_type}: {count}"
+            for issue_type, count in issues_by_type.most_common()
+        ))
 
     # Image summary
-    with_images = sum(1 for q in questions if q.get("images"))
-    total_images = sum(len(q.get("images", [])) for q in questions)
-    print(f"\n📸 Questions with images: {with_images}/{len(questions)}")
-    print(f"📸 Total image URLs: {total_images}")
+    print(f"\n📸 Questions with images: {stats['with_images']}/{len(questions)}")
+    print(f"📸 Total image URLs: {stats['total_images']}")
 
     # Reconstruction summary
-    recon_questions = [q for q in questions if q.get("reconstruction_name")]
-    if recon_questions:
-        recon_names = set(q.get("reconstruction_name") for q in recon_questions)
-        print(f"\n📋 Reconstrucciones: {len(recon_questions)} questions in {len(recon_names)} exams")
-        for name in sorted(recon_names):
-            count = sum(1 for q in recon_questions if q.get("reconstruction_name") == name)
-            print(f"   - {name}: {count} questions")
-
-    # Source files breakdown
-    source_files = {}
-    for q in questions:
-        src = q.get("source_file", "unknown")
-        source_files[src] = source_files.get(src, 0) + 1
+    recon_counts = stats["recon_counts"]
+    if recon_counts:
+        print(f"\n📋 Reconstrucciones: {sum(recon_counts.values())} questions in {len(recon_counts)} exams")
+        print("\n".join(f"   - {name}: {count} questions" for name, count in sorted(recon_counts.items())))
 
+    # Source files breakdown (a line per file, written in one go)
     print(f"\n📁 Questions by source file:")
-    for src, count in sorted(source_files.items()):
-        print(f"   {src}: {count}")
+    if stats["source_files"]:
+        print("\n".join(f"   {src}: {count}" for src, count in sorted(stats["source_files"].items())))
@@ -5,7 +5,7 @@ WITH IMAGE SUPPORT AND RECONSTRUCCIONES
 """
 
 import psycopg2
-from psycopg2.extras import RealDictCursor, Json
+from psycopg2.extras import RealDictCursor, Json, execute_values
 import polars as pl
 import streamlit as st
 import os
@@ -52,13 +52,65 @@ def init_database():
 # ============================================================================
 
 
+# One multi-row INSERT per batch (VALUES %s is expanded by execute_values)
+INSERT_QUESTIONS_SQL = """
+    INSERT INTO questions (
+        question_id, question_number, topic, question_text,
+        answer_options, correct_answer, explanation,
+        source_file, source_type, images,
+        reconstruction_name, reconstruction_order
+    )
+    VALUES %s
+"""
+
+UPSERT_CONFLICT_SQL = """
+    ON CONFLICT (question_id) DO UPDATE SET
+        question_number = EXCLUDED.question_number,
+        topic = EXCLUDED.topic,
+        question_text = EXCLUDED.question_text,
+        answer_options = EXCLUDED.answer_options,
+        correct_answer = EXCLUDED.correct_answer,
+        explanation = EXCLUDED.explanation,
+        source_file = EXCLUDED.source_file,
+        source_type = EXCLUDED.source_type,
+        images = EXCLUDED.images,
+        reconstruction_name = EXCLUDED.reconstruction_name,
+        reconstruction_order = EXCLUDED.reconstruction_order,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+INSERT_ONLY_CONFLICT_SQL = """
+    ON CONFLICT (question_id) DO NOTHING
+"""
+
+
+def question_row(question: dict) -> tuple:
+    """Column values of one question, in INSERT_QUESTIONS_SQL order"""
+    return (
+        question["question_id"],
+        question["question_number"],
+        question["topic"],
+        question["question_text"],
+        Json(question["answer_options"]),
+        question["correct_answer"],
+        question["explanation"],
+        question.get("source_file"),
+        question.get("source_type"),
+        Json(question.get("images", [])),
+        question.get("reconstruction_name"),
+        question.get("reconstruction_order"),
+    )
+
+
 def insert_questions_from_json(questions: list[dict], batch_size: int = 100, upsert: bool = True) -> tuple[int, int]:
     """
     Insert questions from JSON structure into database in batches.
+    Each batch is a single multi-row INSERT and one commit; if a batch fails it is
+    retried row by row, so one bad question only costs itself.
     
     Args:
         questions: List of question dicts
-        batch_size: Commit every N questions
+        batch_size: Questions per INSERT statement / commit
         upsert: If True, update existing questions. If False, skip existing (INSERT only).
         
     Returns:
@@ -67,100 +119,36 @@ def insert_questions_from_json(questions: list[dict], batch_size: int = 100, ups
     conn = get_connection()
     cursor = conn.cursor()
 
+    # UPSERT: Insert or update existing. INSERT ONLY: Skip if exists (ON CONFLICT DO NOTHING)
+    sql = INSERT_QUESTIONS_SQL + (UPSERT_CONFLICT_SQL if upsert else INSERT_ONLY_CONFLICT_SQL)
+
     success_count = 0
     error_count = 0
     total = len(questions)
 
-    for i, question in enumerate(questions):
+    for start in range(0, total, batch_size):
+        batch = questions[start:start + batch_size]
+
         try:
-            images = question.get("images", [])
-            reconstruction_name = question.get("reconstruction_name")
-            reconstruction_order = question.get("reconstruction_order")
-
-            if upsert:
-                # UPSERT: Insert or update existing
-                cursor.execute(
-                    """
-                    INSERT INTO questions (
-                        question_id, question_number, topic, question_text,
-                        answer_options, correct_answer, explanation,
-                        source_file, source_type, images,
-                        reconstruction_name, reconstruction_order
-                    )
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (question_id) DO UPDATE SET
-                        question_number = EXCLUDED.question_number,
-                        topic = EXCLUDED.topic,
-                        question_text = EXCLUDED.question_text,
-                        answer_options = EXCLUDED.answer_options,
-                        correct_answer = EXCLUDED.correct_answer,
-                        explanation = EXCLUDED.explanation,
-                        source_file = EXCLUDED.source_file,
-                        source_type = EXCLUDED.source_type,
-                        images = EXCLUDED.images,
-                        reconstruction_name = EXCLUDED.reconstruction_name,
-                        reconstruction_order = EXCLUDED.reconstruction_order,
-                        updated_at = CURRENT_TIMESTAMP
-                    """,
-                    (
-                        question["question_id"],
-                        question["question_number"],
-                        question["topic"],
-                        question["question_text"],
-                        Json(question["answer_options"]),
-                        question["correct_answer"],
-                        question["explanation"],
-                        question.get("source_file"),
-                        question.get("source_type"),
-                        Json(images),
-                        reconstruction_name,
-                        reconstruction_order,
-                    ),
-                )
-            else:
-                # INSERT ONLY: Skip if exists (ON CONFLICT DO NOTHING)
-                cursor.execute(
-                    """
-                    INSERT INTO questions (
-                        question_id, question_number, topic, question_text,
-                        answer_options, correct_answer, explanation,
-                        source_file, source_type, images,
-                        reconstruction_name, reconstruction_order
-                    )
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (question_id) DO NOTHING
-                    """,
-                    (
-                        question["question_id"],
-                        question["question_number"],
-                        question["topic"],
-                        question["question_text"],
-                        Json(question["answer_options"]),
-                        question["correct_answer"],
-                        question["explanation"],
-                        question.get("source_file"),
-                        question.get("source_type"),
-                        Json(images),
-                        reconstruction_name,
-                        reconstruction_order,
-                    ),
-                )
-            success_count += 1
+            execute_values(cursor, sql, [question_row(q) for q in batch], page_size=len(batch))
+            conn.commit()
+            success_count += len(batch)
+            print(f"   ✅ {start + len(batch)}/{total} inserted...")
+            continue
+        except Exception:
+            conn.rollback()
 
-            # Commit and print progress every batch_size questions
-            if (i + 1) % batch_size == 0:
+        # Batch failed: insert its questions one at a time to isolate the bad ones
+        for question in batch:
+            try:
+                cursor.execute(sql, (question_row(question),))
                 conn.commit()
-                print(f"   ✅ {i + 1}/{total} inserted...")
+                success_count += 1
+            except Exception as e:
+                error_count += 1
+                print(f"❌ Error inserting question {question.get('question_id')}: {e}")
+                conn.rollback()
 
-        except Exception as e:
-            error_count += 1
-            print(f"❌ Error inserting question {question['question_id']}: {e}")
-            conn.rollback()
-            cursor = conn.cursor()
-            continue
-
-    # Final commit
-    conn.commit()
     cursor.close()
     conn.close()
 
@@ -0,0 +1,51 @@
+"""
+Question text must match what BeautifulSoup's get_text gave: no <script>/<style> contents.
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts" / "extraction"))
+
+import extract_guevara  # noqa: E402
+import extract_reconstrucciones  # noqa: E402
+
+PAGE = """<html><head><style>.que{color:red}</style></head><body>
+<div id="question-7-1" class="que multichoice deferredfeedback">
+ <span class="qno">Pregunta <script>qno()</script>1</span>
+ <div class="formulation"><div class="qtext"><style>p.MsoNormal{margin:0}</style><p>Paciente con fiebre &lt;38</p>
+   <script>var x=1;</script><p>¿Cuál?</p></div>
+ <div class="answer">
+  <div class="r0 correct"><div class="d-flex"><span class="answernumber">a. </span><div class="flex-fill">Uno<script>o()</script></div></div></div>
+  <div class="r1"><div class="d-flex"><span class="answernumber">b. </span><div class="flex-fill"><style>i{}</style>Dos</div></div></div>
+ </div></div>
+ <div class="outcome"><div class="rightanswer">La respuesta correcta es: Dos<script>r()</script></div>
+ <div class="generalfeedback"><p>Expl</p><script>f()</script></div></div>
+</div>
+</body></html>
+"""
+
+
+def write_page(tmp_path: Path) -> Path:
+    page = tmp_path / "script.html"
+    page.write_text(PAGE, encoding="utf-8")
+    return page
+
+
+def test_guevara_skips_script_and_style_text(tmp_path):
+    [question] = extract_guevara.extract_from_file(write_page(tmp_path))
+
+    assert question["question_number"] == "Pregunta1"
+    assert question["question_text"] == "Paciente con fiebre <38 ¿Cuál?"
+    assert [opt["text"] for opt in question["answer_options"]] == ["Uno", "Dos"]
+    assert question["explanation"] == "Expl"
+
+
+def test_reconstruction_skips_script_and_style_text(tmp_path):
+    [question] = extract_reconstrucciones.extract_guevara_reconstruction(write_page(tmp_path), "Agosto 2021", 0)
+
+    assert question["question_text"] == "Paciente con fiebre <38 ¿Cuál?"
+    assert [opt["text"] for opt in question["answer_options"]] == ["Uno", "Dos"]
+    # rightanswer text matches option b only without the trailing script
+    assert question["correct_answer"] == "b. Dos"
+    assert question["explanation"] == "Expl"